@@ -2,15 +2,21 @@
 import os
 import shutil
 import subprocess
+import sys
 from pathlib import Path
 from flask import Flask, render_template, send_from_directory, request, jsonify, abort
 
+# photo_catalog lives at the top of the repo
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from photo_catalog import PhotoCatalog
+
 # ====== CONFIG ======
 RAW_DIR   = Path("/home/kcooney/CalendarScreenSaver/raw_images")
 COOKED_DIR   = Path("/home/kcooney/CalendarScreenSaver/cooked_images")
 ALL_DIR      = Path("/home/kcooney/CalendarScreenSaver/all_images")
 DELETED_DIR  = Path("/home/kcooney/CalendarScreenSaver/deleted_images")
 DROPBOX_DIR   = Path("/home/kcooney/Pictures/Dropbox/Frame")  # Dropbox folder syncs here
+CATALOG_FILE = Path("/home/kcooney/CalendarScreenSaver/photo_catalog.db")
 
 # Path to the Dropbox-Uploader script and its config file
 DROPBOX_UPLOADER = Path("/home/kcooney/Dropbox-Uploader/dropbox_uploader.sh")  # adjust if needed
@@ -66,7 +72,7 @@ def api_delete():
     deleted_backup_path = DELETED_DIR / all_rel_path
     dropbox_local_path = DROPBOX_DIR / all_rel_path
 
-    results = {"cooked": None, "raw": None, "dropbox_local": None, "all_images_move": None, "dropbox": None}
+    results = {"cooked": None, "raw": None, "dropbox_local": None, "all_images_move": None, "dropbox": None, "catalog": None}
 
     # 1) Delete from cooked_images
     try:
@@ -109,7 +115,14 @@ def api_delete():
     except Exception as e:
         results["all_images_move"] = f"error: {e}"
 
-    # 5) Remove from Dropbox using Dropbox-Uploader
+    # 5) Mark it deleted in the photo catalog, so image_selector stops choosing it
+    try:
+        with PhotoCatalog(str(CATALOG_FILE)) as catalog:
+            results["catalog"] = "deleted" if catalog.mark_deleted(all_rel_path) else "not_found"
+    except Exception as e:
+        results["catalog"] = f"error: {e}"
+
+    # 6) Remove from Dropbox using Dropbox-Uploader
     try:
         if DROPBOX_UPLOADER.exists() and DROPBOX_CONFIG.exists():
             # Use leading slash for a clear root-relative path in Dropbox
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Benchmark for indexes of near-duplicate photo hashes.
+
+Builds photo_hash's BKTree, and for comparison a multi-index hash, over synthetic
+64-bit dHashes in clusters of near-duplicates the way burst shots and edited copies
+come out, and times queries for everything within Hamming distance k against a
+linear scan, checking all three find the same photos.  The selector's BK-tree only
+ever holds the photos chosen so far; this shows how each would cope with a search
+over the whole library.
+
+    python benchmarks/dedupe_bench.py --size 100000 --distances 2 4 6 10
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from itertools import combinations
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+from photo_hash import HASH_SIZE, BKTree, hamming
+
+def nearby_keys(key, radius, bits):
+    """
+    Yields every bits-wide key within Hamming distance radius of key, key first.
+    """
+    for distance in range(radius + 1):
+        for positions in combinations(range(bits), distance):
+            flipped = key
+            for position in positions:
+                flipped ^= 1 << position
+            yield flipped
+
+class MultiIndexHash:
+    """
+    Hashes indexed by Hamming distance, for searches over the whole library.  Each
+    hash is split into chunks, with a table per chunk.  Two hashes within k bits of
+    each other differ by at most k // chunks bits in at least one chunk, so a search
+    only has to look up keys that close in each table.  Unlike a BKTree, it stays
+    fast for the larger k near-duplicates need.
+    """
+
+    def __init__(self, entries=(), chunks=4):
+        self.chunks = chunks
+        self.bits = HASH_SIZE * HASH_SIZE // chunks
+        self.mask = (1 << self.bits) - 1
+        self.values = []
+        self.items = []
+        # Per chunk: chunk value -> list of indexes into values
+        self.tables = [{} for _ in range(chunks)]
+        for value, item in entries:
+            self.add(value, item)
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value, item):
+        index = len(self.values)
+        self.values.append(value)
+        self.items.append(item)
+        for chunk, table in enumerate(self.tables):
+            key = (value >> (chunk * self.bits)) & self.mask
+            bucket = table.get(key)
+            if bucket is None:
+                table[key] = [index]
+            else:
+                bucket.append(index)
+
+    def find(self, value, max_distance):
+        """
+        :return: A list of (distance, item) for everything within max_distance of value.
+        """
+        radius = max_distance // self.chunks
+        candidates = set()
+        for chunk, table in enumerate(self.tables):
+            for key in nearby_keys((value >> (chunk * self.bits)) & self.mask, radius, self.bits):
+                candidates.update(table.get(key, ()))
+        found = []
+        for index in candidates:
+            distance = hamming(value, self.values[index])
+            if distance <= max_distance:
+                found.append((distance, self.items[index]))
+        return found
+
+def make_hashes(size, cluster_size=5, seed=0):
+    """
+    :return: A list of size hashes: random bases, each followed by a few copies with 0-4 bits flipped.
+    """
+    rng = random.Random(seed)
+    hashes = []
+    while len(hashes) < size:
+        base = rng.getrandbits(64)
+        hashes.append(base)
+        for _ in range(rng.randrange(cluster_size)):
+            flipped = base
+            for bit in rng.sample(range(64), rng.randrange(5)):
+                flipped ^= 1 << bit
+            hashes.append(flipped)
+    return hashes[:size]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000, help="Photos in the index")
+    parser.add_argument("--distances", type=int, nargs="+", default=[2, 4, 6, 10], help="Values of k to query")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per distance")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    hashes = make_hashes(args.size)
+    indexes = {}
+    report = {"size": args.size, "build_s": {}, "queries": []}
+    for name, index_class in (("bktree", BKTree), ("multi_index", MultiIndexHash)):
+        start = time.perf_counter()
+        indexes[name] = index_class((value, i) for i, value in enumerate(hashes))
+        report["build_s"][name] = time.perf_counter() - start
+
+    rng = random.Random(1)
+    queries = [hashes[rng.randrange(len(hashes))] for _ in range(args.queries)]
+    # The linear scan is slow, so only time a few queries of it
+    sample = queries[:max(1, args.queries // 20)]
+    for k in args.distances:
+        row = {"k": k}
+        results = {}
+        for name, index in indexes.items():
+            start = time.perf_counter()
+            results[name] = [sorted(item for _, item in index.find(query, k)) for query in queries]
+            row[f"{name}_query_ms"] = (time.perf_counter() - start) / len(queries) * 1000
+        start = time.perf_counter()
+        scan_results = [[i for i, value in enumerate(hashes) if hamming(query, value) <= k] for query in sample]
+        row["scan_query_ms"] = (time.perf_counter() - start) / len(sample) * 1000
+        row["mean_matches"] = sum(map(len, results["bktree"])) / len(queries)
+        row["agrees"] = all(found[:len(sample)] == scan_results for found in results.values())
+        report["queries"].append(row)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"Built over {args.size} hashes: BK-tree in {report['build_s']['bktree']:.2f}s, "
+          f"multi-index in {report['build_s']['multi_index']:.2f}s")
+    print(f"{'k':>4}{'scan ms':>12}{'bktree ms':>12}{'multi ms':>12}{'matches':>10}  agrees")
+    for row in report["queries"]:
+        print(f"{row['k']:>4}{row['scan_query_ms']:>12.2f}{row['bktree_query_ms']:>12.2f}"
+              f"{row['multi_index_query_ms']:>12.3f}{row['mean_matches']:>10.1f}  {row['agrees']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Files per second for metadata_builder's photo reading.
+
+Times, over the same photos:
+  old:       Image.open, _getexif() and a walk over every tag through TAGS, one file at a time
+  header:    the header-only JPEG parser (PIL fallback for other formats), one at a time
+  features:  the reduced-size decode for dHash, luminance and thumbnail, one at a time
+  pooled:    all of read_photo on a pool of METADATA_WORKERS threads, as metadata_builder runs it
+and checks that the old and new paths agree on every date.  Point --corpus at the
+library on its network mount to see the effect of I/O latency; the OS caches files
+after the first pass, so use --drop-caches (root only) between passes for cold reads.
+
+    python benchmarks/metadata_bench.py --corpus ~/Pictures/Dropbox/Frame --limit 2000
+    python benchmarks/metadata_bench.py --count 500
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from screensaver_bench import REPO_DIR
+
+sys.path.insert(0, REPO_DIR)
+from PIL import Image
+from PIL.ExifTags import TAGS
+import metadata_builder
+from exif_header import read_jpeg_header
+from photo_features import read_features
+
+def make_exif_images(directory, count):
+    """
+    Writes small JPEGs with an Orientation and a DateTimeOriginal, reusing them between runs.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        path = os.path.join(directory, f"exif-{i:05d}.jpg")
+        if os.path.exists(path):
+            continue
+        rng = random.Random(i)
+        exif = Image.Exif()
+        exif[274] = rng.choice((1, 3, 6, 8))
+        exif.get_ifd(0x8769)[36867] = f"{rng.randint(2005, 2024)}:{rng.randint(1, 12):02d}:{rng.randint(1, 28):02d} 12:00:00"
+        Image.new("RGB", (640, 480), (rng.randrange(256), 0, 0)).save(path, quality=80, exif=exif)
+
+def old_read_date(file_path):
+    with Image.open(file_path) as img:
+        exif_data = img._getexif()
+        if not exif_data:
+            return None
+        for tag_id, value in exif_data.items():
+            if TAGS.get(tag_id, tag_id) == "DateTimeOriginal":
+                return value.split(" ")[0].replace(":", "-")
+    return None
+
+def header_read_date(file_path):
+    header = read_jpeg_header(file_path) or metadata_builder.read_pil_header(file_path)
+    if "date_time_original" not in header:
+        return None
+    return header["date_time_original"].split(" ")[0].replace(":", "-")
+
+def new_read_date(item):
+    return metadata_builder.read_photo(*item).get("capture_date")
+
+def drop_caches():
+    subprocess.run(["sync"], check=False)
+    try:
+        with open("/proc/sys/vm/drop_caches", 'w') as file:
+            file.write("3\n")
+    except OSError as e:
+        print(f"Could not drop caches: {e}")
+
+def timed(label, function, paths, drop):
+    if drop:
+        drop_caches()
+    start = time.perf_counter()
+    results = function(paths)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<8}{len(paths) / elapsed:>12.0f} files/s  ({elapsed:.2f}s)")
+    return results, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Directory of photos to read (searched recursively)")
+    parser.add_argument("--limit", type=int, default=2000, help="Use at most this many photos from the corpus")
+    parser.add_argument("--count", type=int, default=500, help="Synthetic photos, if no corpus")
+    parser.add_argument("--workers", type=int, default=metadata_builder.METADATA_WORKERS, help="Threads for the pooled run")
+    parser.add_argument("--drop-caches", action="store_true", help="Drop the page cache before each pass (needs root)")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "metadata_bench"))
+    args = parser.parse_args()
+
+    directory = args.corpus
+    if not directory:
+        directory = args.workdir
+        make_exif_images(directory, args.count)
+    paths = sorted(path for path, _ in metadata_builder.walk_files(directory))[:args.limit]
+    if not paths:
+        print("No photos to read")
+        return
+    items = [(path, os.stat(path)) for path in paths]
+
+    print(f"{len(paths)} photos from {directory}")
+    old, old_seconds = timed("old", lambda ps: [old_read_date(p) for p in ps], paths, args.drop_caches)
+    new, header_seconds = timed("header", lambda ps: [header_read_date(p) for p in ps], paths, args.drop_caches)
+    timed("features", lambda ps: [read_features(p) for p in ps], paths, args.drop_caches)
+
+    def pooled(its):
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            return list(pool.map(new_read_date, its))
+    pooled_dates, pooled_seconds = timed("pooled", pooled, items, args.drop_caches)
+
+    mismatches = [(p, a, b) for p, a, b in zip(paths, old, new) if a != b]
+    print(f"Header parser is {old_seconds / header_seconds:.1f}x the old path, "
+          f"and all of read_photo is {old_seconds / pooled_seconds:.1f}x with {args.workers} threads")
+    if pooled_dates != new:
+        print("Pooled run disagreed with the serial one")
+    print(f"{len(mismatches)} dates differ from the old path")
+    for path, a, b in mismatches[:10]:
+        print(f"  {path}: old {a}, new {b}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Compares image_selector's resize path against the old one.
+
+For each photo in the corpus, times:
+  old:  full decode, then img.resize() with PIL's default filter
+  new:  JPEG draft() decode, then image_selector.downscale() (Lanczos with reducing_gap)
+and scores both against a reference (full decode, plain Lanczos) with PSNR.
+
+    python benchmarks/resize_bench.py --corpus ~/Pictures/Dropbox/Frame --limit 50
+    python benchmarks/resize_bench.py --resolution 8000x6000 --count 10
+"""
+import argparse
+import math
+import os
+import sys
+import tempfile
+import time
+
+from screensaver_bench import REPO_DIR, make_images, parse_size
+
+sys.path.insert(0, REPO_DIR)
+from PIL import Image, ImageChops, ImageStat
+import image_selector
+
+TARGET_HEIGHT = 1080
+
+def target_size(img):
+    return int(TARGET_HEIGHT * img.width / img.height), TARGET_HEIGHT
+
+def old_resize(path):
+    with Image.open(path) as img:
+        return img.resize(target_size(img))
+
+def new_resize(path):
+    with Image.open(path) as img:
+        size = target_size(img)
+        img.draft("RGB", size)
+        return image_selector.downscale(img, size)
+
+def reference_resize(path):
+    with Image.open(path) as img:
+        return img.resize(target_size(img), Image.LANCZOS)
+
+def psnr(image, reference):
+    diff = ImageChops.difference(image.convert("RGB"), reference.convert("RGB"))
+    mse = sum(rms * rms for rms in ImageStat.Stat(diff).rms) / 3
+    return float("inf") if mse == 0 else 10 * math.log10(255 * 255 / mse)
+
+def timed(function, path):
+    start = time.perf_counter()
+    result = function(path)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Directory of photos to resize (searched recursively)")
+    parser.add_argument("--limit", type=int, default=50, help="Use at most this many photos from the corpus")
+    parser.add_argument("--resolution", action="append", type=parse_size, help="Synthetic photo size, if no corpus")
+    parser.add_argument("--count", type=int, default=10, help="Synthetic photos per resolution")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "resize_bench"))
+    args = parser.parse_args()
+
+    if args.corpus:
+        paths = []
+        for root, _, files in os.walk(args.corpus):
+            paths += [os.path.join(root, f) for f in files if f.lower().endswith((".jpg", ".jpeg"))]
+        paths = sorted(paths)[:args.limit]
+    else:
+        make_images(args.workdir, args.resolution or [(4032, 3024), (8160, 6120)], args.count)
+        paths = sorted(os.path.join(args.workdir, f) for f in os.listdir(args.workdir))
+    if not paths:
+        print("No photos to resize")
+        return
+
+    totals = {"old": [0.0, 0.0], "new": [0.0, 0.0]}
+    print(f"{'photo':<40}{'old ms':>10}{'new ms':>10}{'old dB':>10}{'new dB':>10}")
+    for path in paths:
+        reference = reference_resize(path)
+        old, old_seconds = timed(old_resize, path)
+        new, new_seconds = timed(new_resize, path)
+        old_psnr, new_psnr = psnr(old, reference), psnr(new, reference)
+        totals["old"][0] += old_seconds
+        totals["old"][1] += old_psnr
+        totals["new"][0] += new_seconds
+        totals["new"][1] += new_psnr
+        print(f"{os.path.basename(path)[-39:]:<40}{old_seconds * 1000:>10.0f}{new_seconds * 1000:>10.0f}"
+              f"{old_psnr:>10.1f}{new_psnr:>10.1f}")
+
+    count = len(paths)
+    old_seconds, old_psnr = totals["old"]
+    new_seconds, new_psnr = totals["new"]
+    print(f"{'mean':<40}{old_seconds / count * 1000:>10.0f}{new_seconds / count * 1000:>10.0f}"
+          f"{old_psnr / count:>10.1f}{new_psnr / count:>10.1f}")
+    print(f"New path is {old_seconds / new_seconds:.1f}x faster over {count} photos")
+
+if __name__ == "__main__":
+    main()
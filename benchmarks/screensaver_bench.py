@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Headless benchmark for the screensaver's slideshow.
+
+Runs run_slideshow under SDL's dummy video driver against a directory of synthetic
+photos, for a fixed number of slides, and reports time to first frame, slides per
+second, per-stage latency and peak memory.
+
+    python benchmarks/screensaver_bench.py --resolution 4032x3024 --count 40 --slides 200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+def make_images(directory, resolutions, count):
+    """
+    Writes `count` JPEGs per resolution, with enough texture that decoding isn't trivial.
+    Existing files are reused between runs.
+    """
+    from PIL import Image, ImageDraw
+
+    os.makedirs(directory, exist_ok=True)
+    for width, height in resolutions:
+        for i in range(count):
+            path = os.path.join(directory, f"synthetic-{width}x{height}-{i:03d}.jpg")
+            if os.path.exists(path):
+                continue
+            rng = random.Random(i)
+            image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+            draw = ImageDraw.Draw(image)
+            for _ in range(200):
+                x, y = rng.randrange(width), rng.randrange(height)
+                size = rng.randrange(10, max(11, width // 8))
+                color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+                draw.ellipse((x, y, x + size, y + size), fill=color)
+            image.save(path, quality=90)
+
+def make_events(path):
+    from datetime import datetime, timedelta
+
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    events = {}
+    for offset in range(-7, 35):
+        day = today + timedelta(days=offset)
+        events[day.isoformat()] = [f"Event {n} on {day:%b %d}" for n in range(offset % 4)]
+    with open(path, 'w') as file:
+        json.dump(events, file)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolution", action="append", type=parse_size, help="Photo size, e.g. 4032x3024 (repeatable)")
+    parser.add_argument("--count", type=int, default=40, help="Photos per resolution")
+    parser.add_argument("--slides", type=int, default=200, help="Slides to show before stopping")
+    parser.add_argument("--screen", type=parse_size, default=(1920, 1080), help="Window size")
+    parser.add_argument("--portrait", action="store_true", help="Use the portrait (calendar) layout")
+    parser.add_argument("--transition", choices=("cut", "fade"), default="cut", help="Slide transition")
+    parser.add_argument("--low-memory", action="store_true", help="Run in low-memory mode (LOW_MEMORY=1)")
+    parser.add_argument("--fast-start", action="store_true", help="Start from (and save) a snapshot of the last frame")
+    parser.add_argument("--shared-cache", action="store_true", help="Use (and fill) the cross-process slide cache")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "screensaver_bench"))
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+    resolutions = args.resolution or [(4032, 3024)]
+
+    image_dir = os.path.join(args.workdir, "images")
+    make_images(image_dir, resolutions, args.count)
+    event_file = os.path.join(args.workdir, "events.json")
+    make_events(event_file)
+
+    # Everything the screensaver reads at import time has to be set before importing it
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["ALL_EVENTS_FILE"] = event_file
+    os.environ["RAW_DIR"] = image_dir
+    os.environ["SLIDE_DIR"] = os.path.join(args.workdir, "no_slides")
+    os.environ["LAYOUT_FILE"] = os.path.join(args.workdir, "layout.json")
+    os.environ["TRANSITION"] = args.transition
+    # Keep snapshots out of the repo, and out of the timings unless they're what's measured
+    os.environ["SNAPSHOT_FILE"] = os.path.join(args.workdir, "last_frame.rgb")
+    os.environ["FAST_START"] = "1" if args.fast_start else "0"
+    os.environ["SHM_CACHE_DIR"] = os.path.join(args.workdir, "shm_cache")
+    if not args.shared_cache:
+        os.environ["SHM_CACHE_MB"] = "0"
+    if args.low_memory:
+        os.environ["LOW_MEMORY"] = "1"
+    os.chdir(REPO_DIR)
+    sys.path.insert(0, REPO_DIR)
+    import screensaver
+
+    screensaver.metrics.enabled = True
+    aspect = screensaver.PORTRAIT if args.portrait else screensaver.LANDSCAPE
+    start = time.perf_counter()
+    screensaver.run_slideshow(display_time=0, aspect=aspect, screen_size=args.screen, max_slides=args.slides)
+    elapsed = time.perf_counter() - start
+
+    snapshot = screensaver.metrics.snapshot()
+    first_frame = snapshot.get("time_to_first_frame_s", 0.0)
+    report = {
+        "resolutions": [f"{w}x{h}" for w, h in resolutions],
+        "photos": args.count * len(resolutions),
+        "slides": args.slides,
+        "screen": f"{args.screen[0]}x{args.screen[1]}",
+        "aspect": "portrait" if args.portrait else "landscape",
+        "time_to_first_frame_s": first_frame,
+        "slides_per_second": (args.slides - 1) / (elapsed - first_frame) if elapsed > first_frame else 0.0,
+        "elapsed_s": elapsed,
+        "peak_rss_kb": snapshot["peak_rss_kb"],
+        "bytes_copied_per_image": screensaver.bytes_copied_per_image(),
+        "low_memory": args.low_memory,
+        "transition": args.transition,
+        "fast_start": args.fast_start,
+        "fade_fps": snapshot.get("fade_fps"),
+        "fade_dropped_frames": snapshot.get("fade_dropped_frames"),
+        "stages": {stage: {key: value for key, value in stats.items() if key != "histogram_ms"}
+                   for stage, stats in snapshot["stages"].items()},
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Photos:              {report['photos']} at {', '.join(report['resolutions'])}")
+    print(f"Screen:              {report['screen']} {report['aspect']}")
+    print(f"Time to first frame: {first_frame * 1000:.1f} ms")
+    print(f"Slides per second:   {report['slides_per_second']:.1f} over {args.slides} slides")
+    print(f"Peak RSS:            {report['peak_rss_kb'] / 1024:.1f} MB")
+    if report["fade_fps"] is not None:
+        print(f"Crossfade:           {report['fade_fps']:.1f} fps, {report['fade_dropped_frames']} frames dropped")
+    print(f"{'stage':<10}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  (ms)")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<10}{stats['count']:>8}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}"
+              f"{stats['p90_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark for image_selector's photo selection.
+
+Builds synthetic libraries of the given sizes and times the old selection (sort the
+whole dict by date string, then scan every entry for the seasonal window) against
+photo_index.PhotoIndex: building the index, and then each selection from it.
+
+    python benchmarks/selection_bench.py --sizes 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+from photo_index import PhotoIndex
+
+IMAGE_COUNT = 40
+RECENT_COUNT = 7
+
+def make_library(size, seed=0):
+    """
+    :return: A dict of filename to 'YYYY-MM-DD' over 20 years, with 1% of photos undated.
+    """
+    rng = random.Random(seed)
+    first = date(2005, 1, 1).toordinal()
+    last = date.today().toordinal()
+    library = {}
+    for i in range(size):
+        if rng.random() < 0.01:
+            library[f"./all_images/person{i % 5}/IMG_{i:07d}.jpg"] = "No EXIF data"
+        else:
+            library[f"./all_images/person{i % 5}/IMG_{i:07d}.jpg"] = date.fromordinal(rng.randint(first, last)).isoformat()
+    return library
+
+def old_select(images_and_dates, today):
+    """
+    The selection image_selector did before PhotoIndex, with its wraparound fixed.
+    """
+    sorted_images = dict(sorted(images_and_dates.items(), key=lambda item: item[1], reverse=True))
+    recent_images = list(sorted_images)[0:RECENT_COUNT]
+    future = (today + timedelta(days=30)).strftime("%m-%d")
+    past = (today - timedelta(days=15)).strftime('%m-%d')
+    wraparound = future < past
+    seasonal_images = []
+    for image in sorted_images:
+        photo_date = sorted_images[image][5:10]
+        if (not wraparound and past < photo_date < future) or (wraparound and (photo_date > past or photo_date < future)):
+            seasonal_images.append(image)
+    random.shuffle(seasonal_images)
+    images_to_use = list(dict.fromkeys(recent_images + seasonal_images))
+    return images_to_use[0:IMAGE_COUNT]
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Library sizes")
+    parser.add_argument("--selections", type=int, default=100, help="Selections to time per index")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    # One date in the middle of the year and one whose window wraps into January
+    days = [datetime(2024, 6, 15), datetime(2024, 12, 20)]
+    report = []
+    for size in args.sizes:
+        library = make_library(size)
+        _, old_seconds = timed(lambda: [old_select(library, today) for today in days])
+        index, build_seconds = timed(PhotoIndex, library)
+        _, select_seconds = timed(lambda: [index.select(days[i % 2], IMAGE_COUNT, RECENT_COUNT, 15, 30)
+                                           for i in range(args.selections)])
+        weighted = lambda position: 1.0 + position / len(index.paths)
+        _, weighted_seconds = timed(lambda: index.select(days[0], IMAGE_COUNT, RECENT_COUNT, 15, 30, weight=weighted))
+        report.append({
+            "size": size,
+            "old_select_ms": old_seconds / len(days) * 1000,
+            "index_build_ms": build_seconds * 1000,
+            "select_ms": select_seconds / args.selections * 1000,
+            "weighted_select_ms": weighted_seconds * 1000,
+        })
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{'photos':>10}{'old ms':>12}{'build ms':>12}{'select ms':>12}{'weighted ms':>13}")
+    for row in report:
+        print(f"{row['size']:>10}{row['old_select_ms']:>12.1f}{row['index_build_ms']:>12.1f}"
+              f"{row['select_ms']:>12.3f}{row['weighted_select_ms']:>13.1f}")
+
+if __name__ == "__main__":
+    main()
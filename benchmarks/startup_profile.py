@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Startup profile for the screensaver.
+
+Launches a fresh interpreter with -X importtime, the way xscreensaver launches
+screensaver.py, and shows one slide under SDL's dummy driver.  Reports the slowest
+imports, and how long after launch the snapshot and the first live frame appeared.
+Run it twice: the first run leaves the snapshot that the second one starts from.
+
+    python benchmarks/startup_profile.py --top 15
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from screensaver_bench import REPO_DIR, make_events, make_images, parse_size
+
+CHILD = """
+import json, sys, time
+imports_started = time.time()
+import screensaver
+imports_done = time.time()
+screensaver.run_slideshow(display_time=0, screen_size=({width}, {height}), max_slides=1)
+print("STARTUP " + json.dumps({{
+    "imports_started": imports_started,
+    "imports_done": imports_done,
+    "time_to_snapshot_s": screensaver.metrics.extra.get("time_to_snapshot_s"),
+    "time_to_first_frame_s": screensaver.metrics.extra.get("time_to_first_frame_s"),
+}}))
+"""
+
+def parse_importtime(stderr):
+    """
+    :return: A list of (cumulative_us, self_us, module) for each import line.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        imports.append((int(cumulative_us), int(self_us), module.rstrip()))
+    return imports
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--screen", type=parse_size, default=(1920, 1080), help="Window size")
+    parser.add_argument("--top", type=int, default=15, help="How many of the slowest imports to list")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "screensaver_bench"))
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    image_dir = os.path.join(args.workdir, "images")
+    make_images(image_dir, [(4032, 3024)], 4)
+    event_file = os.path.join(args.workdir, "events.json")
+    make_events(event_file)
+
+    env = dict(os.environ)
+    env.update({
+        "SDL_VIDEODRIVER": "dummy",
+        "ALL_EVENTS_FILE": event_file,
+        "RAW_DIR": image_dir,
+        "SLIDE_DIR": os.path.join(args.workdir, "no_slides"),
+        "LAYOUT_FILE": os.path.join(args.workdir, "layout.json"),
+        "SNAPSHOT_FILE": os.path.join(args.workdir, "last_frame.rgb"),
+        # Measure a real decode, not slides the live screensaver or an earlier run left in /dev/shm
+        "SHM_CACHE_DIR": os.path.join(args.workdir, "shm_cache"),
+        "SHM_CACHE_MB": "0",
+    })
+    width, height = args.screen
+    launched = time.time()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD.format(width=width, height=height)],
+        cwd=REPO_DIR, env=env, capture_output=True, text=True, check=False,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr)
+        sys.exit(proc.returncode)
+    startup = next(json.loads(line[len("STARTUP "):]) for line in proc.stdout.splitlines() if line.startswith("STARTUP "))
+
+    imports = parse_importtime(proc.stderr)
+    # Top-level imports are the ones without leading indentation in the module column
+    top_level = [entry for entry in imports if not entry[2].startswith("  ")]
+    slowest = sorted(top_level, reverse=True)[:args.top]
+    imports_s = startup["imports_done"] - startup["imports_started"]
+    report = {
+        "interpreter_startup_s": startup["imports_started"] - launched,
+        "imports_s": imports_s,
+        "time_to_snapshot_s": None,
+        "time_to_first_frame_s": None,
+        "slowest_imports": [{"module": module.strip(), "cumulative_ms": cumulative / 1000, "self_ms": own / 1000}
+                            for cumulative, own, module in slowest],
+    }
+    # run_slideshow measures from its own start; add everything before it
+    before_run = startup["imports_done"] - launched
+    for key in ("time_to_snapshot_s", "time_to_first_frame_s"):
+        if startup[key] is not None:
+            report[key] = before_run + startup[key]
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Interpreter startup: {report['interpreter_startup_s'] * 1000:.0f} ms")
+    print(f"Imports:             {imports_s * 1000:.0f} ms")
+    if report["time_to_snapshot_s"] is not None:
+        print(f"Snapshot on screen:  {report['time_to_snapshot_s'] * 1000:.0f} ms after launch")
+    else:
+        print("Snapshot on screen:  none yet (run again to start from the saved frame)")
+    print(f"First live frame:    {report['time_to_first_frame_s'] * 1000:.0f} ms after launch")
+    print("Slowest top-level imports:")
+    for entry in report["slowest_imports"]:
+        print(f"  {entry['cumulative_ms']:>8.1f} ms  {entry['module']}")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 import os
 import shutil
+import sqlite3
 from PIL import Image, ImageDraw, ImageFont, ExifTags
 from dotenv import load_dotenv
+from photo_catalog import PhotoCatalog
 
 load_dotenv()
 
@@ -9,6 +11,9 @@ COOKED_DIR = os.environ.get('COOKED_DIR', "./cooked_images")
 RAW_DIR = os.environ.get('RAW_DIR', "./raw_images")
 EVENT_FILE = os.environ.get('EVENT_FILE', "./events.txt")
 FONT_FILE = os.environ.get('FONT_FILE', "/usr/share/fonts/truetype/freefont/FreeSans.ttf")
+CATALOG_FILE = os.environ.get('PHOTO_CATALOG', "./photo_catalog.db")
+# Photos with a mean grey level (0-255) at least this bright get a darker text background
+BRIGHT_LUMINANCE = 150
 
 #enum constants
 TODAY_MODE = 1
@@ -74,13 +79,15 @@ def get_filenames_in_directory(directory):
         print(f"An error occurred: {e}")
         return []
 
-def add_text_with_background(image_filename, output_directory, text):
+def add_text_with_background(image_filename, output_directory, text, luminance=None):
     """
     Adds text with a translucent black background to the upper-left corner of an image and saves the result.
 
     :param image_filename: Path to the input image file.
     :param output_directory: Path to the output directory.
     :param text: The text to add to the image.
+    :param luminance: The photo's mean grey level from the catalog, if known; bright
+                      photos get a darker background so the white text stays readable.
     """
     LEFT_PADDING = 20
     TOP_PADDING = 20
@@ -119,6 +126,8 @@ def add_text_with_background(image_filename, output_directory, text):
         padding = 20
         background_position = (LEFT_PADDING, TOP_PADDING, (2 * LEFT_PADDING) + (text_width + 2 * padding), (2 * TOP_PADDING) + (text_height + 2 * padding))
         background_color = (0, 0, 0, 96)  # RGBA - black with 50% transparency
+        if luminance is not None and luminance >= BRIGHT_LUMINANCE:
+            background_color = (0, 0, 0, 160)
 
         # Create an overlay for the background
         overlay = Image.new("RGBA", image.size, (255, 255, 255, 0))
@@ -162,11 +171,21 @@ def main():
 
     # Read images
     raw_image_filenames = get_filenames_in_directory(RAW_DIR)
+    # Only for text contrast, so carry on without it if the catalog can't be read
+    photos = {}
+    try:
+        with PhotoCatalog(CATALOG_FILE) as catalog:
+            # raw_images names are library paths with "/" flattened to "--"
+            photos = {name: catalog.get_by_relpath(name.replace("--", "/")) for name in raw_image_filenames}
+    except sqlite3.Error as e:
+        print(f"Could not read {CATALOG_FILE}: {e}")
     # Add events to those images
     for raw_image_filename in raw_image_filenames:
         raw_file_path = os.path.join(RAW_DIR, raw_image_filename)
         if event_string is not None:
-            add_text_with_background(raw_file_path, COOKED_DIR, event_string)
+            photo = photos.get(raw_image_filename)
+            luminance = photo["luminance"] if photo is not None else None
+            add_text_with_background(raw_file_path, COOKED_DIR, event_string, luminance)
         else:
             shutil.copy2(raw_file_path, COOKED_DIR + "/")  
         # Save image
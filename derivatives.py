@@ -0,0 +1,92 @@
+import json
+import mmap
+import os
+import struct
+
+# Display-ready slides.  The screensaver publishes its photo geometry to LAYOUT_FILE;
+# image_selector then writes each chosen photo already scaled (and rotated, in portrait)
+# to exactly that size, as raw RGB pixels the screensaver can map straight into a surface.
+
+RAW_EXTENSION = ".rgb"
+RAW_MAGIC = b"CSSRAW1\0"
+# magic, width, height, flags
+RAW_HEADER = struct.Struct("<8sIII")
+RAW_ROTATED = 1
+
+def fit_size(width, height, box_width, box_height):
+    """
+    Scales a size to the largest that fits in the box, keeping its aspect ratio.
+    A size that already fills the box in one dimension is returned unchanged, so a
+    derivative made for the box is never scaled a second time.
+
+    :return: A (width, height) tuple of ints.
+    """
+    box_width, box_height = int(box_width), int(box_height)
+    if width <= box_width and height <= box_height and (width == box_width or height == box_height):
+        return width, height
+    aspect = width / height
+    if box_width / box_height > aspect:
+        return int(box_height * aspect), box_height
+    return box_width, int(box_width / aspect)
+
+def write_layout(layout_file, layout):
+    """
+    Publishes the screensaver's geometry, only touching the file when it changed.
+
+    :param layout: A dict with screen_width, screen_height, aspect, margin,
+                   photo_width, photo_height and rotate (degrees counterclockwise).
+    """
+    if read_layout(layout_file) == layout:
+        return
+    tmp_file = layout_file + ".tmp"
+    with open(tmp_file, 'w') as file:
+        json.dump(layout, file, indent=2)
+    os.replace(tmp_file, layout_file)
+
+def read_layout(layout_file):
+    """
+    :return: The layout dict written by write_layout, or None if there isn't one.
+    """
+    try:
+        with open(layout_file, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def write_raw_image(pil_image, path, rotated=False):
+    """
+    Saves a PIL image as raw RGB pixels behind a small header.
+    The file is written under a temporary name and renamed into place.
+    """
+    if pil_image.mode != "RGB":
+        pil_image = pil_image.convert("RGB")
+    write_raw_pixels(path, pil_image.size, pil_image.tobytes(), rotated)
+
+def write_raw_pixels(path, size, pixels, rotated=False):
+    """
+    Saves RGB bytes of the given (width, height) behind a raw image header.
+    """
+    width, height = size
+    # Per-process temporary name, since several screensavers may write the same slide
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(RAW_HEADER.pack(RAW_MAGIC, width, height, RAW_ROTATED if rotated else 0))
+        file.write(pixels)
+    os.replace(tmp_path, path)
+
+def read_raw_image(path):
+    """
+    Maps a raw image written by write_raw_image into memory without copying it.
+    The mapping is copy-on-write, so whatever is built on it can't change the file.
+
+    :return: A (width, height, rotated, pixels) tuple, where pixels is a buffer of RGB bytes.
+    """
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    if len(mapped) < RAW_HEADER.size:
+        raise ValueError(f"{path} is not a raw slide image")
+    magic, width, height, flags = RAW_HEADER.unpack_from(mapped)
+    if magic != RAW_MAGIC or len(mapped) < RAW_HEADER.size + width * height * 3:
+        raise ValueError(f"{path} is not a raw slide image")
+    pixels = memoryview(mapped)[RAW_HEADER.size:RAW_HEADER.size + width * height * 3]
+    return width, height, bool(flags & RAW_ROTATED), pixels
@@ -0,0 +1,108 @@
+import struct
+
+# Reads what metadata_builder needs from a JPEG without decoding it: the size from the
+# frame header, and Orientation and DateTimeOriginal from the EXIF block.  Only the
+# segments before the image data are read, a few KB for a typical photo.
+
+ORIENTATION = 274
+EXIF_IFD_POINTER = 34665
+DATE_TIME_ORIGINAL = 36867
+
+# Start-of-frame markers, which hold the image size; C4, C8 and CC are other tables
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers without a length
+STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7}
+
+# Bytes per value for the TIFF field types this reads
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 7: 1}
+
+def read_ifd(tiff, offset, byte_order):
+    """
+    :return: A dict of tag to (type, count, value bytes) for one IFD.
+    """
+    entries = {}
+    (count,) = struct.unpack_from(byte_order + "H", tiff, offset)
+    for i in range(count):
+        tag, field_type, value_count, value = struct.unpack_from(byte_order + "HHI4s", tiff, offset + 2 + i * 12)
+        size = TYPE_SIZES.get(field_type)
+        if size is None:
+            continue
+        length = size * value_count
+        if length > 4:
+            (value_offset,) = struct.unpack(byte_order + "I", value)
+            value = tiff[value_offset:value_offset + length]
+            if len(value) < length:
+                raise ValueError("EXIF value runs past the end of the block")
+        entries[tag] = (field_type, value_count, value[:length])
+    return entries
+
+def read_exif(tiff):
+    """
+    Parses the TIFF structure in an APP1 Exif segment.
+
+    :return: A dict with orientation and date_time_original, where present.
+    """
+    byte_order = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if byte_order is None:
+        raise ValueError("Not a TIFF header")
+    magic, ifd0_offset = struct.unpack_from(byte_order + "HI", tiff, 2)
+    if magic != 42:
+        raise ValueError("Not a TIFF header")
+
+    exif = {}
+    ifd0 = read_ifd(tiff, ifd0_offset, byte_order)
+    if ORIENTATION in ifd0 and ifd0[ORIENTATION][0] == 3:
+        exif["orientation"] = struct.unpack_from(byte_order + "H", ifd0[ORIENTATION][2])[0]
+    if EXIF_IFD_POINTER in ifd0:
+        (exif_offset,) = struct.unpack_from(byte_order + "I", ifd0[EXIF_IFD_POINTER][2])
+        exif_ifd = read_ifd(tiff, exif_offset, byte_order)
+        if DATE_TIME_ORIGINAL in exif_ifd and exif_ifd[DATE_TIME_ORIGINAL][0] == 2:
+            exif["date_time_original"] = exif_ifd[DATE_TIME_ORIGINAL][2].split(b"\0", 1)[0].decode("ascii", "replace")
+    return exif
+
+def read_jpeg_header(path):
+    """
+    Reads the size and EXIF fields of a JPEG from its header.
+
+    :return: A dict with width and height, plus has_exif, orientation and
+             date_time_original where present; or None if the file isn't a JPEG
+             this can read, so the caller should fall back to PIL.
+    """
+    try:
+        with open(path, 'rb') as file:
+            if file.read(2) != b"\xff\xd8":
+                return None
+            info = {"has_exif": False}
+            while True:
+                byte = file.read(1)
+                if byte != b"\xff":
+                    return None
+                marker = file.read(1)
+                # Any number of 0xFF fill bytes may come before a marker
+                while marker == b"\xff":
+                    marker = file.read(1)
+                if not marker:
+                    return None
+                marker = marker[0]
+                if marker in STANDALONE_MARKERS:
+                    continue
+                # End of image or start of scan before a frame header: give up
+                if marker in (0xD9, 0xDA):
+                    return None
+                length_bytes = file.read(2)
+                if len(length_bytes) < 2:
+                    return None
+                (length,) = struct.unpack(">H", length_bytes)
+                if marker in SOF_MARKERS:
+                    _, height, width = struct.unpack(">BHH", file.read(5))
+                    info["width"], info["height"] = width, height
+                    return info
+                if marker == 0xE1 and not info["has_exif"]:
+                    segment = file.read(length - 2)
+                    if segment.startswith(b"Exif\0\0"):
+                        info["has_exif"] = True
+                        info.update(read_exif(segment[6:]))
+                else:
+                    file.seek(length - 2, 1)
+    except (struct.error, ValueError, IndexError):
+        return None
@@ -1,155 +1,355 @@
 from datetime import datetime, timedelta
-import random
 import shutil
 import os
-import glob
+import tempfile
+import time
+import hashlib
+import json
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 from PIL import Image
 from dotenv import load_dotenv
+from photo_catalog import PhotoCatalog, import_metadata_file
+from photo_features import shape
+from photo_hash import NearDuplicateFilter
+from photo_index import PhotoIndex
+from derivatives import RAW_EXTENSION, fit_size, read_layout, write_raw_image
 
 load_dotenv()
 
 
 ALL_DIR = os.environ.get('ALL_IMAGE_DIR', "./all_images")
 RAW_DIR = os.environ.get('RAW_DIR', "./raw_images")
+CATALOG_FILE = os.environ.get('PHOTO_CATALOG', "./photo_catalog.db")
+# Only read once, to fill an empty catalog
 METADATA_FILE = os.environ.get('METADATA_FILE', "./metadata.txt")
+# Display-ready copies for the screensaver, made to the geometry it publishes in LAYOUT_FILE
+SLIDE_DIR = os.environ.get('SLIDE_DIR', "./slides")
+LAYOUT_FILE = os.environ.get('LAYOUT_FILE', "./layout.json")
 IMAGE_COUNT = 40
+# The newest photos always go in; the rest come from around today's date in other years
+RECENT_COUNT = 7
+SEASONAL_DAYS_BEFORE = 15
+SEASONAL_DAYS_AFTER = 30
+# Photos whose dHashes differ in this many bits or fewer count as the same shot; -1 keeps them all
+DEDUPE_DISTANCE = int(os.environ.get('DEDUPE_DISTANCE', "6"))
+# Photos darker than this mean grey level (0-255) are passed over; 0 keeps them all
+MIN_LUMINANCE = float(os.environ.get('MIN_LUMINANCE', "0"))
+# "landscape" or "portrait" makes seasonal photos of that shape PREFER_WEIGHT times as likely
+# to be chosen; "auto" prefers the shape of the screensaver's photo area
+PREFER_ORIENTATION = os.environ.get('PREFER_ORIENTATION', "")
+PREFER_WEIGHT = 3.0
+# Every derivative ever made, by source and parameters; RAW_DIR and SLIDE_DIR link into it
+STORE_DIR = os.environ.get('DERIVATIVE_STORE', "./derivative_store")
+# Derivatives no selection has used for this long are removed, and then the least
+# recently used until the store fits in STORE_MAX_MB
+STORE_MAX_AGE_DAYS = int(os.environ.get('STORE_MAX_AGE_DAYS', "14"))
+STORE_MAX_MB = int(os.environ.get('STORE_MAX_MB', "1024"))
+STORE_MANIFEST = os.path.join(STORE_DIR, "last_used.json")
+# See downscale()
+REDUCING_GAP = float(os.environ.get('REDUCING_GAP', "3.0"))
+# Worker processes for resizing; 1 resizes one photo at a time in this process
+RESIZE_WORKERS = int(os.environ.get('RESIZE_WORKERS', str(os.cpu_count() or 1)))
 
-def read_tab_delimited_file_to_dict(input_file):
+def downscale(img, size):
     """
-    Reads a tab-delimited text file and reconstructs the dictionary.
+    Resizes with Lanczos, letting PIL reduce() by whole factors first while the image is
+    more than REDUCING_GAP times the target.  At 3 or more that looks the same as a plain
+    Lanczos resize, but costs far less for the big reductions phone photos need.
+    """
+    return img.resize(size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+
+def resized_name_for(image_filename):
+    """
+    Flattens a path under ALL_DIR into a file name, e.g. Kevin/IMG_1.jpg -> Kevin--IMG_1.jpg
+    """
+    resized_name = image_filename
+    resized_name = resized_name.replace(ALL_DIR + "\\", "")
+    resized_name = resized_name.replace(ALL_DIR + "/", "")
+    resized_name = resized_name.replace(ALL_DIR, "")
+    resized_name = resized_name.replace("/", "--")
+    resized_name = resized_name.replace("\\", "--")
+    return resized_name
+
+def derivative_path(image_filename, stat, extension, *params):
+    """
+    Where the derivative of a photo made with the given parameters lives in STORE_DIR.
+    The name is a hash of the source's path, size and mtime plus the parameters, so an
+    edited photo or a new layout gets a new entry instead of a stale one.
+    """
+    identity = (os.path.abspath(image_filename), stat.st_size, stat.st_mtime_ns) + params
+    return os.path.join(STORE_DIR, hashlib.sha1(repr(identity).encode()).hexdigest() + extension)
+
+def resize_image(image_filename, layout):
+    """
+    Makes whatever derivatives of one photo the store is missing: the 1080-high copy and,
+    if the screensaver published a layout, its display-ready slide.  Runs in a worker process.
 
-    :param input_file: The path to the tab-delimited text file.
-    :return: A dictionary where keys are filenames and values are dates.
+    :return: (image_filename, (raw_path, slide_path), seconds, made, error), where the
+             paths are in STORE_DIR, made says whether anything had to be decoded, and
+             error is None on success.
     """
-    reconstructed_dict = {}
-    
+    start = time.perf_counter()
+    target_height = 1080
     try:
-        with open(input_file, 'r') as file:
-            # Skip the header row
-            #next(file)
-            
-            # Read each line and split by tab to reconstruct the dictionary
-            for line in file:
-                parts = line.strip().split("\t")
-                if len(parts) == 2:  # Ensure there are exactly two columns
-                    filename, date = parts
-                    reconstructed_dict[filename] = date
-        
-        print(f"Data successfully reconstructed from {input_file}")
-    except FileNotFoundError:
-        print(f"The file '{input_file}' does not exist.")
+        stat = os.stat(image_filename)
+        extension = os.path.splitext(image_filename)[1].lower()
+        raw_path = derivative_path(image_filename, stat, extension, "raw", target_height, REDUCING_GAP)
+        slide_path = None
+        if layout is not None:
+            slide_path = derivative_path(image_filename, stat, RAW_EXTENSION, "slide",
+                                         layout["photo_width"], layout["photo_height"], layout["rotate"], REDUCING_GAP)
+        make_raw = not os.path.exists(raw_path)
+        make_slide = slide_path is not None and not os.path.exists(slide_path)
+
+        if make_raw or make_slide:
+            # Open the image
+            with Image.open(image_filename) as img:
+                # Calculate new width while maintaining aspect ratio
+                aspect_ratio = img.width / img.height
+                new_width = int(target_height * aspect_ratio)
+                #exif_data = img.info.get("exif")
+                slide_size = None
+                if layout is not None:
+                    slide_size = fit_size(img.width, img.height, layout["photo_width"], layout["photo_height"])
+
+                # Have the JPEG decoder skip detail neither output needs
+                draft_size = (new_width, target_height)
+                if make_slide:
+                    draft_size = (max(new_width, slide_size[0]), max(target_height, slide_size[1]))
+                img.draft("RGB", draft_size)
+
+                # Resize the image and save it under a temporary name, then rename it into the store
+                if make_raw:
+                    resized_img = downscale(img, (new_width, target_height))
+                    tmp_path = f"{raw_path}.{os.getpid()}.tmp"
+                    resized_img.save(tmp_path, format=img.format) #, exif=exif_data)
+                    os.replace(tmp_path, raw_path)
+
+                # Save the screensaver's copy at exactly its photo size, so it never scales or rotates
+                if make_slide:
+                    slide_img = downscale(img, slide_size)
+                    if layout["rotate"] == 90:
+                        slide_img = slide_img.transpose(Image.ROTATE_90)
+                    write_raw_image(slide_img, slide_path, rotated=layout["rotate"] == 90)
     except Exception as e:
-        print(f"An error occurred while reading the file: {e}")
-    
-    return reconstructed_dict
+        return image_filename, None, time.perf_counter() - start, False, e
+    return image_filename, (raw_path, slide_path), time.perf_counter() - start, make_raw or make_slide, None
+
+def resize_images(images_to_use, layout, workers=RESIZE_WORKERS):
+    """
+    Brings the derivative store up to date for the chosen photos on a pool of worker
+    processes.  At most two per worker are in flight at once, so memory use doesn't
+    depend on how many photos were chosen.
+
+    :return: A list of (image_filename, raw_path, slide_path) for the photos that worked.
+    """
+    start = time.perf_counter()
+    busy_seconds = 0.0
+    made = 0
+    derivatives = []
 
+    def report(result):
+        nonlocal busy_seconds, made
+        image_filename, paths, seconds, was_made, error = result
+        busy_seconds += seconds
+        if error is not None:
+            print(f"Error processing {image_filename}: {error}")
+            return
+        derivatives.append((image_filename,) + paths)
+        if was_made:
+            made += 1
+            print(f"Resized and saved: {paths[0]}")
 
+    if workers <= 1:
+        for image_filename in images_to_use:
+            report(resize_image(image_filename, layout))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for image_filename in images_to_use:
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        report(future.result())
+                pending.add(pool.submit(resize_image, image_filename, layout))
+            for future in as_completed(pending):
+                report(future.result())
 
-# Example usage:
-# reconstructed_data = read_tab_delimited_file_to_dict("output.txt")
-# print(reconstructed_data)
+    elapsed = time.perf_counter() - start
+    # busy_seconds is roughly what the same work takes one photo at a time
+    speedup = busy_seconds / elapsed if elapsed > 0 else 1.0
+    print(f"Resized {made} and reused {len(derivatives) - made} of {len(images_to_use)} images in {elapsed:.1f}s "
+          f"on {max(1, workers)} workers ({busy_seconds:.1f}s of serial work, {speedup:.1f}x speedup)")
+    return derivatives
 
+def link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+def publish_directory(staging_dir, target):
+    """
+    Makes target a symlink to staging_dir in a single rename, so readers of target see
+    either the old set of files or the new one, never a half-filled directory.  The
+    directory target pointed to before is removed afterwards.  If target is still a
+    plain directory from before the store existed, it is replaced once, non-atomically.
+    """
+    target = target.rstrip("/\\")
+    previous = os.path.realpath(target) if os.path.islink(target) else None
+    link_tmp = target + ".link-tmp"
+    if os.path.lexists(link_tmp):
+        os.remove(link_tmp)
+    os.symlink(os.path.basename(staging_dir), link_tmp)
+    if os.path.isdir(target) and not os.path.islink(target):
+        shutil.rmtree(target)
+    os.replace(link_tmp, target)
+    if previous is not None and previous != os.path.realpath(staging_dir) and os.path.isdir(previous):
+        shutil.rmtree(previous, ignore_errors=True)
+
+def stage_directory(target, derivatives, name_suffix=""):
+    """
+    Fills a new directory next to target with links to the given store files, then
+    publishes it as target.
+    """
+    target = target.rstrip("/\\")
+    # Unique even for two runs in the same second
+    staging_dir = tempfile.mkdtemp(prefix=f"{os.path.basename(target)}.{datetime.now():%Y%m%d-%H%M%S}.",
+                                   dir=os.path.dirname(target) or ".")
+    # mkdtemp makes it private, but the screensaver may run as another user
+    os.chmod(staging_dir, 0o755)
+    for image_filename, store_path in derivatives:
+        link_or_copy(store_path, os.path.join(staging_dir, resized_name_for(image_filename) + name_suffix))
+    publish_directory(staging_dir, target)
 
-def sort_dict_by_date_desc(data):
+def read_store_manifest():
+    """
+    :return: A dict of store file name to when a selection last used it.  Kept in a
+             file rather than in the files' mtimes, which the links in RAW_DIR and
+             SLIDE_DIR share, and the screensaver keys its caches on.
+    """
+    try:
+        with open(STORE_MANIFEST, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
 
-    # Sort by parsed date, with invalid dates treated as the oldest
-    sorted_items = sorted(data.items(), key=lambda item: item[1], reverse=True)
+def write_store_manifest(manifest):
+    tmp_file = STORE_MANIFEST + ".tmp"
+    with open(tmp_file, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(tmp_file, STORE_MANIFEST)
 
-    # Convert back to a dictionary
-    return dict(sorted_items)
+def prune_store(derivatives, max_age_days=STORE_MAX_AGE_DAYS, max_bytes=STORE_MAX_MB * 1024 * 1024):
+    """
+    Records that this selection used the given derivatives, then removes the ones no
+    selection has used for max_age_days, and then the least recently used until the
+    store fits in max_bytes.  Files this selection used, or that a published
+    directory still links to, are never removed.
+    """
+    now = time.time()
+    manifest = read_store_manifest()
+    in_use = set()
+    for _, raw_path, slide_path in derivatives:
+        for path in (raw_path, slide_path):
+            if path is not None:
+                in_use.add(os.path.basename(path))
+                manifest[os.path.basename(path)] = now
 
-# Example usage:
-# reconstructed_data = read_tab_delimited_file_to_dict("output.txt")
-# sorted_data = sort_dict_by_date_desc(reconstructed_data)
-# print(sorted_data)
+    # (last used, size, name, path) for each file that could go
+    candidates = []
+    total_bytes = 0
+    present = set()
+    with os.scandir(STORE_DIR) as it:
+        for entry in it:
+            if not entry.is_file() or entry.path == STORE_MANIFEST or entry.name.endswith(".tmp"):
+                continue
+            present.add(entry.name)
+            stat = entry.stat()
+            total_bytes += stat.st_size
+            if entry.name not in in_use and stat.st_nlink == 1:
+                # Files from before the manifest fall back to when they were made
+                candidates.append((manifest.get(entry.name, stat.st_mtime), stat.st_size, entry.name, entry.path))
 
+    cutoff = now - max_age_days * 24 * 3600
+    candidates.sort()
+    removed = 0
+    for last_used, size, name, path in candidates:
+        if last_used >= cutoff and total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Could not remove {path}: {e}")
+            continue
+        manifest.pop(name, None)
+        total_bytes -= size
+        removed += 1
+    write_store_manifest({name: last_used for name, last_used in manifest.items() if name in present})
+    if removed:
+        print(f"Pruned {removed} unused derivatives from {STORE_DIR}, leaving {total_bytes / (1024 * 1024):.0f} MB")
+    if total_bytes > max_bytes:
+        print(f"{STORE_DIR} is {total_bytes / (1024 * 1024):.0f} MB, over STORE_MAX_MB, with nothing left it can remove")
 
 def main():
-    images_and_dates = read_tab_delimited_file_to_dict(METADATA_FILE)
+    with PhotoCatalog(CATALOG_FILE) as catalog:
+        if len(catalog) == 0 and os.path.exists(METADATA_FILE):
+            # First run since metadata.txt was replaced by the catalog
+            print(f"Importing {METADATA_FILE} into {CATALOG_FILE}")
+            import_metadata_file(catalog, METADATA_FILE, ALL_DIR)
+        images_and_dates = catalog.dates()
+        hashes = catalog.hashes() if DEDUPE_DISTANCE >= 0 else {}
+        features = catalog.features() if MIN_LUMINANCE > 0 or PREFER_ORIENTATION else {}
     print("There are " + str(len(images_and_dates)) + " images")
     if len(images_and_dates) == 0:
         print("No images found")
-        exit
-    sorted_images = sort_dict_by_date_desc(images_and_dates)
-
-    num_recent_images = 7
-    if len(sorted_images) < 7:
-        num_recent_images = len(sorted_images)
-    print("Looking for " + str(num_recent_images) + " recent images")
-    recent_images = list(sorted_images)[0:(num_recent_images-1)]
-    print("Grabbed " + str(len(recent_images)) + " recent ones")
-    #print(recent_images)
-
-    seasonal_images = []
-    future_date = datetime.now() + timedelta(days=30)
-    past_date = datetime.now() - timedelta(days=15)
-    future = future_date.strftime("%m-%d")
-    past = past_date.strftime('%m-%d')
-    print("Looking for images from " + past + " to " + future)
-
-    wraparound = False
-    if (future < past):
-        wraparound = True
-    
-    for image in sorted_images:
-        photo_date = sorted_images[image][5:9]
-        if not wraparound and photo_date > past and photo_date < future:
-            seasonal_images.append(image)
-        elif wraparound and photo_date > past or photo_date < future:
-            seasonal_images.append(image)
-    random.shuffle(seasonal_images)
-    # print("Seasonal images")
-    # print(seasonal_images)
-
-    # Combine recent images with seasonal images
-    images_to_use = recent_images + seasonal_images
-    images_to_use = list(dict.fromkeys(images_to_use)) # deduplicate
-
-    if len(images_to_use) < IMAGE_COUNT:
-        print ("Padding out the images")
-        # If not enough, add more
-        # Note this could add duplicates
-        additional_photos = list(sorted_images)
-        random.shuffle(additional_photos)
-        images_to_use += additional_photos[0:IMAGE_COUNT-len(images_to_use)]
-    elif len(images_to_use) > IMAGE_COUNT:
-        print ("Cutting down the images")
-        # If too many, remove some
-        images_to_use = images_to_use[0:(IMAGE_COUNT-1)] 
-
-    # Clear out the last crop
-    print ("Deleting old ones")
-    files = glob.glob(RAW_DIR + '/*')
-    for f in files:
-        os.remove(f)
+        return
+    index = PhotoIndex(images_and_dates)
+    print(f"{len(index.paths)} have dates")
+
+    today = datetime.now()
+    past = (today - timedelta(days=SEASONAL_DAYS_BEFORE)).strftime('%m-%d')
+    future = (today + timedelta(days=SEASONAL_DAYS_AFTER)).strftime("%m-%d")
+    print("Looking for " + str(RECENT_COUNT) + " recent images, then images from " + past + " to " + future)
+    layout = read_layout(LAYOUT_FILE)
+    preferred = PREFER_ORIENTATION
+    if preferred == "auto":
+        preferred = shape(layout["photo_width"], layout["photo_height"], None) if layout is not None else ""
+    weight = None
+    if preferred:
+        print("Preferring " + preferred + " images")
+        def weight(position):
+            photo = features.get(index.paths[position])
+            return PREFER_WEIGHT if photo is not None and shape(*photo[:3]) == preferred else 1.0
+
+    # Everything here runs on the catalog; no photo is opened to choose
+    duplicates = NearDuplicateFilter(hashes, DEDUPE_DISTANCE)
+    dark = 0
+    def accept(path):
+        nonlocal dark
+        photo = features.get(path)
+        if photo is not None and photo[3] is not None and photo[3] < MIN_LUMINANCE:
+            dark += 1
+            return False
+        return duplicates(path)
+    images_to_use = index.select(today, IMAGE_COUNT, RECENT_COUNT, SEASONAL_DAYS_BEFORE, SEASONAL_DAYS_AFTER,
+                                 weight=weight, accept=accept)
+    print("Chose " + str(len(images_to_use)) + " images; " + str(duplicates.rejected) + " near-duplicates and " +
+          str(dark) + " dark ones were passed over, and only used to fill places left over")
+
+    if layout is not None:
+        print(f"Making {layout['photo_width']}x{layout['photo_height']} slides, rotated {layout['rotate']}")
 
     print ("Saving new ones")
-    target_height = 1080
-    # Put in the new ones
-    for image_filename in images_to_use:
-        try:
-            # Open the image
-            with Image.open(image_filename) as img:
-                # Calculate new width while maintaining aspect ratio
-                aspect_ratio = img.width / img.height
-                new_width = int(target_height * aspect_ratio)
-                #exif_data = img.info.get("exif")
+    os.makedirs(STORE_DIR, exist_ok=True)
+    derivatives = resize_images(images_to_use, layout)
 
-                # Resize the image
-                resized_img = img.resize((new_width, target_height))
-
-                # Save the resized image
-                resized_name = image_filename
-                resized_name = resized_name.replace(ALL_DIR + "\\", "")
-                resized_name = resized_name.replace(ALL_DIR + "/", "")
-                resized_name = resized_name.replace(ALL_DIR, "")
-                resized_name = resized_name.replace("/", "--")
-                resized_name = resized_name.replace("\\", "--")
-                output_path = os.path.join(RAW_DIR, resized_name)
-                resized_img.save(output_path) #, exif=exif_data)
-                print(f"Resized and saved: {output_path}")
-        except Exception as e:
-            print(f"Error processing {image_filename}: {e}")
+    # Swap in the new crop all at once
+    stage_directory(RAW_DIR, [(image_filename, raw_path) for image_filename, raw_path, _ in derivatives])
+    if layout is not None:
+        stage_directory(SLIDE_DIR, [(image_filename, slide_path) for image_filename, _, slide_path in derivatives], RAW_EXTENSION)
+    print(f"Published {len(derivatives)} images to {RAW_DIR}")
+    prune_store(derivatives)
 
 
 if __name__ == "__main__":
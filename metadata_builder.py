@@ -1,77 +1,152 @@
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from PIL import Image
-from PIL.ExifTags import TAGS
+from exif_header import DATE_TIME_ORIGINAL, EXIF_IFD_POINTER, ORIENTATION, read_jpeg_header
+from photo_catalog import PhotoCatalog
+from photo_features import read_features
 
 load_dotenv()
 
 ALL_IMG_DIR = os.environ.get('ALL_IMAGE_DIR', "./all_images")
-METADATA_FILE = os.environ.get('METADATE_FILE', "./metadata.txt")
+CATALOG_FILE = os.environ.get('PHOTO_CATALOG', "./photo_catalog.db")
+# Threads reading photo headers; the library is on a network mount, so they mostly wait on I/O
+METADATA_WORKERS = int(os.environ.get('METADATA_WORKERS', "16"))
+# Photos per catalog transaction
+WRITE_BATCH = 500
+# Bump when read_photo learns something new, so photos read before get read again
+READER_VERSION = 3
+
+def read_pil_header(file_path):
+    """
+    Reads what read_jpeg_header does, for formats it can't: PNG, HEIC and the like.
+    """
+    with Image.open(file_path) as img:
+        exif = img.getexif()
+        header = {"width": img.width, "height": img.height, "has_exif": bool(exif)}
+        if ORIENTATION in exif:
+            header["orientation"] = exif[ORIENTATION]
+        date_time_original = exif.get_ifd(EXIF_IFD_POINTER).get(DATE_TIME_ORIGINAL)
+        if date_time_original is not None:
+            header["date_time_original"] = date_time_original
+    return header
+
+def read_photo(file_path, stat):
+    """
+    Reads what the catalog keeps about one photo: its size and mtime, dimensions,
+    EXIF orientation, the date it was taken, and from one reduced-size decode, a
+    perceptual hash, mean luminance and thumbnail.
 
-def get_photo_dates(directory):
+    :return: A dict for PhotoCatalog.update_photos, without relpath.
+    """
+    photo = {"path": file_path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "reader_version": READER_VERSION}
+    try:
+        # JPEGs only need their first few KB read; anything else goes through PIL
+        header = read_jpeg_header(file_path) or read_pil_header(file_path)
+    except Exception as e:
+        # Leave out size and mtime, so a passing error on the mount is retried next run
+        # instead of being remembered until the file changes
+        return {"path": file_path, "note": f"Error reading file: {e}"}
+
+    photo["width"], photo["height"] = header["width"], header["height"]
+    try:
+        photo.update(read_features(file_path, header.get("orientation")))
+    except Exception as e:
+        print(f"Could not read features of {file_path}: {e}")
+        # An older version, so the next run tries again, e.g. once NumPy is installed
+        photo["reader_version"] = READER_VERSION - 1
+    if not header["has_exif"]:
+        photo["note"] = "No EXIF data"
+        return photo
+    photo["orientation"] = header.get("orientation")
+    if "date_time_original" in header:
+        # Format the date
+        photo["capture_date"] = header["date_time_original"].split(" ")[0].replace(":", "-")  # Format as 'YYYY-MM-DD'
+    else:
+        photo["note"] = "No DateTimeOriginal tag"
+    return photo
+
+def walk_files(directory):
+    """
+    Yields (path, os.stat_result) for every file under directory.  Folders wait on a
+    stack instead of in recursive calls, and os.scandir tells files from folders
+    without a stat call per entry.
+    """
+    folders = [directory]
+    while folders:
+        with os.scandir(folders.pop()) as it:
+            for entry in it:
+                if entry.is_dir():
+                    folders.append(entry.path)
+                elif entry.is_file():
+                    yield entry.path, entry.stat()
+
+def get_photo_dates(directory, catalog):
     """
-    Reads photo metadata for every image in the directory and extracts the date the photo was taken.
+    Reads photo metadata for new and changed images in the directory and extracts the date the photo was taken.
+    Files the catalog has at the same size and mtime, read by this READER_VERSION, are
+    skipped, and every file found is recorded in the catalog's current scan.  Photos come out as they're read, with a
+    bounded number in flight, so memory use doesn't grow with the library.
 
     :param directory: The path to the directory containing images.
-    :return: A dictionary with image filenames as keys and photo dates as values, formatted as 'YYYY-MM-DD'.
+    :param catalog: A PhotoCatalog with a scan started.
+    :return: A generator of dicts from read_photo, with relpath set.
     """
-    if not os.path.isdir(directory):
-        print(f"The specified path '{directory}' is not a directory.")
-        return {}
-
-    photo_dates = {}
-
-    for filename in os.listdir(directory):
-        file_path = os.path.join(directory, filename)
-
-        if not os.path.isfile(file_path):
-            subfolder_photo_dates = get_photo_dates(file_path)
-            photo_dates = photo_dates | subfolder_photo_dates
-            continue  # Skip non-file entries
-
-        try:
-            # Open the image and check for EXIF data
-            with Image.open(file_path) as img:
-                exif_data = img._getexif()
-                if not exif_data:
-                    photo_dates[file_path] = "No EXIF data"
-                    continue
-
-                # Look for the DateTimeOriginal tag (usually tag ID 36867)
-                for tag_id, value in exif_data.items():
-                    tag = TAGS.get(tag_id, tag_id)
-                    if tag == "DateTimeOriginal":
-                        # Format the date
-                        photo_date = value.split(" ")[0].replace(":", "-")  # Format as 'YYYY-MM-DD'
-                        photo_dates[file_path] = photo_date
-                        break
-                #else:
-                #    photo_dates[filename] = "No DateTimeOriginal tag"
-        except Exception as e:
-            photo_dates[file_path] = f"Error reading file: {e}"
-
-    return photo_dates
+    def finished(future):
+        photo = future.result()
+        photo["relpath"] = os.path.relpath(photo["path"], directory)
+        return photo
+
+    workers = max(1, METADATA_WORKERS)
+    present = []
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for file_path, stat in walk_files(directory):
+            present.append(file_path)
+            if len(present) >= WRITE_BATCH:
+                catalog.record_present(present)
+                present = []
+            if catalog.file_stat(file_path) == (stat.st_size, stat.st_mtime_ns, READER_VERSION):
+                continue
+            pending.append(pool.submit(read_photo, file_path, stat))
+            while len(pending) > workers * 4 or (pending and pending[0].done()):
+                yield finished(pending.popleft())
+        catalog.record_present(present)
+        while pending:
+            yield finished(pending.popleft())
 
 # Example usage:
 # directory_path = "path/to/your/directory"
-# photo_metadata = get_photo_dates(directory_path)
-# print(photo_metadata)
+# with PhotoCatalog(CATALOG_FILE) as catalog:
+#     catalog.start_scan()
+#     for photo in get_photo_dates(directory_path, catalog):
+#         print(photo)
 
 
 def main():
 
-    photo_metadata = get_photo_dates(ALL_IMG_DIR)
+    if not os.path.isdir(ALL_IMG_DIR):
+        # Don't let a missing mount look like every photo was deleted
+        print(f"The specified path '{ALL_IMG_DIR}' is not a directory.")
+        return
     try:
-        with open(METADATA_FILE, 'w') as file:
-            
-            # Write each key-value pair
-            for key, value in photo_metadata.items():
-                file.write(f"{key}\t{value}\n")
-        
-        print(f"Data written to {METADATA_FILE}")
+        with PhotoCatalog(CATALOG_FILE) as catalog:
+            catalog.start_scan()
+            # Written in batches as they're read, so an interrupted run keeps what it did
+            changed = 0
+            batch = []
+            for photo in get_photo_dates(ALL_IMG_DIR, catalog):
+                batch.append(photo)
+                if len(batch) >= WRITE_BATCH:
+                    changed += catalog.update_photos(batch)
+                    batch = []
+            changed += catalog.update_photos(batch)
+            found, missing = catalog.finish_scan()
+        print(f"{found} photos, {changed} new or changed, {missing} no longer there; written to {CATALOG_FILE}")
     except Exception as e:
-        print(f"An error occurred while writing to the file: {e}")
+        print(f"An error occurred while writing to the catalog: {e}")
 
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
@@ -0,0 +1,225 @@
+import os
+import sqlite3
+import sys
+
+from photo_index import parse_date
+
+# Everything known about the photo library, in one SQLite file: metadata_builder
+# writes it, image_selector reads it, and the admin app marks deletions in it.
+
+CATALOG_FILE = os.environ.get('PHOTO_CATALOG', "./photo_catalog.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS photos (
+    path TEXT PRIMARY KEY,      -- as metadata_builder found it, e.g. ./all_images/Kevin/IMG_1.jpg
+    relpath TEXT NOT NULL,      -- relative to the library, e.g. Kevin/IMG_1.jpg
+    capture_date TEXT,          -- 'YYYY-MM-DD', or NULL if the photo has no usable date
+    day_of_year INTEGER,        -- 0-365, as photo_index.day_of_year counts them
+    note TEXT,                  -- why there's no date, e.g. "No EXIF data"
+    size INTEGER,
+    mtime_ns INTEGER,
+    width INTEGER,
+    height INTEGER,
+    orientation INTEGER,        -- EXIF orientation, 1-8
+    dhash INTEGER,              -- photo_hash.dhash, as a signed 64-bit int
+    luminance REAL,             -- mean grey level, 0-255
+    thumbnail BLOB,             -- JPEG, photo_features.THUMBNAIL_SIZE on its long side, upright
+    reader_version INTEGER,     -- metadata_builder.READER_VERSION that read the row
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS photos_relpath ON photos (relpath);
+CREATE INDEX IF NOT EXISTS photos_capture_date ON photos (deleted, capture_date);
+CREATE INDEX IF NOT EXISTS photos_day_of_year ON photos (deleted, day_of_year);
+"""
+
+COLUMNS = ("path", "relpath", "capture_date", "day_of_year", "note", "size", "mtime_ns", "width", "height", "orientation",
+           "dhash", "luminance", "thumbnail", "reader_version")
+# Columns added since the first catalogs were made, with their types
+ADDED_COLUMNS = (("dhash", "INTEGER"), ("reader_version", "INTEGER"), ("luminance", "REAL"), ("thumbnail", "BLOB"))
+
+def to_signed64(value):
+    return value - (1 << 64) if value is not None and value >= 1 << 63 else value
+
+class PhotoCatalog:
+    """
+    The photos table, keyed by path.  A photo that disappears from the library, or
+    is deleted in the admin app, keeps its row with deleted set, and comes back to
+    life if it's found again.
+    """
+
+    def __init__(self, catalog_file=CATALOG_FILE):
+        # The builder, the selector and the admin app may all have it open at once
+        self.connection = sqlite3.connect(catalog_file, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        existing = {row["name"] for row in self.connection.execute("PRAGMA table_info(photos)")}
+        with self.connection:
+            for column, column_type in ADDED_COLUMNS:
+                if column not in existing:
+                    self.connection.execute(f"ALTER TABLE photos ADD COLUMN {column} {column_type}")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM photos WHERE deleted = 0").fetchone()[0]
+
+    def get(self, path):
+        """
+        :return: The photo's row as a dict, or None.
+        """
+        row = self.connection.execute("SELECT * FROM photos WHERE path = ?", (path,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def get_by_relpath(self, relpath):
+        """
+        :return: The row of the photo at relpath in the library, as a dict, or None if
+                 there isn't one or it's deleted.
+        """
+        row = self.connection.execute(
+            "SELECT * FROM photos WHERE relpath = ? AND deleted = 0", (relpath,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def update_photos(self, photos):
+        """
+        Adds or replaces photos, in one transaction.
+
+        :param photos: An iterable of dicts with path and relpath, and any of capture_date,
+                       note, size, mtime_ns, width, height, orientation, dhash, luminance,
+                       thumbnail and reader_version.
+        :return: How many photos were written.
+        """
+        def rows():
+            for photo in photos:
+                parsed = parse_date(photo["capture_date"]) if photo.get("capture_date") else None
+                photo = dict(photo, day_of_year=parsed[1] if parsed else None, dhash=to_signed64(photo.get("dhash")))
+                if parsed is None:
+                    photo["capture_date"] = None
+                yield tuple(photo.get(column) for column in COLUMNS)
+
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        with self.connection:
+            cursor = self.connection.executemany(
+                f"INSERT OR REPLACE INTO photos ({', '.join(COLUMNS)}, deleted) VALUES ({placeholders}, 0)", rows())
+        return cursor.rowcount
+
+    def mark_deleted(self, relpath):
+        """
+        Marks the photo at relpath in the library as deleted.
+
+        :return: True if there was such a photo.
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                "UPDATE photos SET deleted = 1 WHERE relpath = ? AND deleted = 0", (relpath,))
+        return cursor.rowcount > 0
+
+    def start_scan(self):
+        """
+        Starts recording which photos a walk of the library finds.  Call record_present
+        as files are found, then finish_scan once the walk is complete.
+        """
+        with self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS present (path TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM present")
+
+    def record_present(self, paths):
+        with self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO present VALUES (?)", ((path,) for path in paths))
+
+    def finish_scan(self):
+        """
+        Marks every photo the scan didn't find as deleted.  Only call this after a
+        complete walk; an interrupted one would look like missing photos.
+
+        :return: A (found, marked) tuple of counts.
+        """
+        with self.connection:
+            found = self.connection.execute("SELECT COUNT(*) FROM present").fetchone()[0]
+            cursor = self.connection.execute(
+                "UPDATE photos SET deleted = 1 WHERE deleted = 0 AND path NOT IN (SELECT path FROM present)")
+            self.connection.execute("DELETE FROM present")
+        return found, cursor.rowcount
+
+    def file_stat(self, path):
+        """
+        :return: The (size, mtime_ns, reader_version) the photo had when it was read,
+                 or None if it's new or deleted, for telling which files need reading.
+        """
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, reader_version FROM photos WHERE path = ? AND deleted = 0", (path,)).fetchone()
+        return tuple(row) if row is not None else None
+
+    def dates(self):
+        """
+        :return: A dict of path to 'YYYY-MM-DD' for every photo that isn't deleted, with
+                 the note in place of the date for undated photos, as PhotoIndex takes.
+        """
+        rows = self.connection.execute(
+            "SELECT path, COALESCE(capture_date, note, '') FROM photos WHERE deleted = 0")
+        return dict(rows)
+
+    def hashes(self):
+        """
+        :return: A dict of path to dHash, as an unsigned int, for every photo that has
+                 one and isn't deleted.
+        """
+        rows = self.connection.execute("SELECT path, dhash FROM photos WHERE deleted = 0 AND dhash IS NOT NULL")
+        return {path: value & 0xFFFFFFFFFFFFFFFF for path, value in rows}
+
+    def features(self):
+        """
+        :return: A dict of path to (width, height, orientation, luminance) for every
+                 photo that isn't deleted, for planning without opening photos.
+        """
+        rows = self.connection.execute(
+            "SELECT path, width, height, orientation, luminance FROM photos WHERE deleted = 0")
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+def import_metadata_file(catalog, metadata_file, library_dir):
+    """
+    Loads a tab-delimited metadata.txt, as metadata_builder used to write, into the catalog.
+
+    :param library_dir: The directory the paths in the file are under, for relpath.
+    :return: How many photos were imported.
+    """
+    def photos(file):
+        for line in file:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) != 2:
+                continue
+            path, date = parts
+            photo = {"path": path, "relpath": os.path.relpath(path, library_dir)}
+            if parse_date(date) is not None:
+                photo["capture_date"] = date
+            else:
+                photo["note"] = date
+            yield photo
+
+    with open(metadata_file, 'r') as file:
+        return catalog.update_photos(photos(file))
+
+def main():
+    # python photo_catalog.py import [metadata.txt]
+    if len(sys.argv) < 2 or sys.argv[1] != "import":
+        print("Usage: photo_catalog.py import [METADATA_FILE]")
+        sys.exit(2)
+    metadata_file = sys.argv[2] if len(sys.argv) > 2 else os.environ.get('METADATA_FILE', "./metadata.txt")
+    library_dir = os.environ.get('ALL_IMAGE_DIR', "./all_images")
+    with PhotoCatalog() as catalog:
+        try:
+            count = import_metadata_file(catalog, metadata_file, library_dir)
+        except OSError as e:
+            print(f"Could not read {metadata_file}: {e}")
+            sys.exit(1)
+        print(f"Imported {count} photos from {metadata_file} into {CATALOG_FILE}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import io
+
+from photo_hash import dhash
+
+# What metadata_builder learns by decoding a photo once, at a fraction of its size:
+# its perceptual hash, mean brightness and a thumbnail.  With these and the header
+# fields in the catalog, later stages plan without opening the photo again.
+
+THUMBNAIL_SIZE = 32
+
+def oriented_size(width, height, orientation):
+    """
+    :return: The (width, height) the photo shows at once its EXIF orientation is applied.
+    """
+    if orientation in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+def shape(width, height, orientation):
+    """
+    :return: "landscape", "portrait", or None if the size isn't known.
+    """
+    if not width or not height:
+        return None
+    width, height = oriented_size(width, height, orientation)
+    return "landscape" if width >= height else "portrait"
+
+def read_features(path, orientation=None):
+    """
+    Decodes a photo once, JPEGs at reduced size, and computes its dHash, mean
+    luminance (0-255) and a JPEG thumbnail, turned upright by the orientation.
+
+    :return: A dict with dhash, luminance and thumbnail.
+    """
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image.draft("RGB", (THUMBNAIL_SIZE * 2, THUMBNAIL_SIZE * 2))
+        image = image.convert("RGB")
+    grey = image.convert("L")
+    features = {
+        "dhash": dhash(grey),
+        "luminance": float(np.asarray(grey, dtype=np.float32).mean()),
+    }
+
+    image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+    # The same transposes as PIL's ImageOps.exif_transpose
+    transpose = {
+        2: Image.FLIP_LEFT_RIGHT,
+        3: Image.ROTATE_180,
+        4: Image.FLIP_TOP_BOTTOM,
+        5: Image.TRANSPOSE,
+        6: Image.ROTATE_270,
+        7: Image.TRANSVERSE,
+        8: Image.ROTATE_90,
+    }.get(orientation)
+    if transpose is not None:
+        image = image.transpose(transpose)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=80)
+    features["thumbnail"] = buffer.getvalue()
+    return features
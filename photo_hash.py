@@ -0,0 +1,107 @@
+# Perceptual hashes for spotting near-duplicate photos: burst shots, edited copies and
+# the same photo saved twice.  metadata_builder stores a 64-bit dHash per photo in
+# the catalog, and image_selector uses a BK-tree over them to skip a photo that's
+# within a few bits of one it already chose.
+
+HASH_SIZE = 8
+
+def dhash(image):
+    """
+    Difference hash: shrinks the image to 9x8 grey pixels and sets one bit per pixel
+    for whether it's brighter than its left neighbour.
+
+    :param image: A PIL image.
+    :return: A 64-bit int.
+    """
+    import numpy as np
+    from PIL import Image
+
+    small = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+class BKTree:
+    """
+    Hashes indexed by Hamming distance.  Each node's children are keyed by their
+    distance from it, and by the triangle inequality a search for everything within
+    k of a hash only has to visit children whose key is within k of that hash's
+    distance to the node, which for small k skips most of the tree.
+    """
+
+    def __init__(self, entries=()):
+        # Parallel lists, one entry per distinct hash
+        self.hashes = []
+        self.items = []
+        self.children = []
+        for value, item in entries:
+            self.add(value, item)
+
+    def __len__(self):
+        return sum(len(items) for items in self.items)
+
+    def _new_node(self, value, item):
+        self.hashes.append(value)
+        self.items.append([item])
+        self.children.append({})
+        return len(self.hashes) - 1
+
+    def add(self, value, item):
+        if not self.hashes:
+            self._new_node(value, item)
+            return
+        node = 0
+        while True:
+            distance = hamming(value, self.hashes[node])
+            if distance == 0:
+                self.items[node].append(item)
+                return
+            child = self.children[node].get(distance)
+            if child is None:
+                self.children[node][distance] = self._new_node(value, item)
+                return
+            node = child
+
+    def find(self, value, max_distance):
+        """
+        :return: A list of (distance, item) for everything within max_distance of value.
+        """
+        found = []
+        nodes = [0] if self.hashes else []
+        while nodes:
+            node = nodes.pop()
+            distance = hamming(value, self.hashes[node])
+            if distance <= max_distance:
+                found.extend((distance, item) for item in self.items[node])
+            for edge, child in self.children[node].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    nodes.append(child)
+        return found
+
+class NearDuplicateFilter:
+    """
+    Accepts photos one at a time, rejecting any whose hash is within max_distance
+    of one already accepted.  Photos without a hash are always accepted.
+    """
+
+    def __init__(self, hashes, max_distance):
+        """
+        :param hashes: A dict of path to dHash, from PhotoCatalog.hashes.
+        """
+        self.hashes = hashes
+        self.max_distance = max_distance
+        self.accepted = BKTree()
+        self.rejected = 0
+
+    def __call__(self, path):
+        value = self.hashes.get(path)
+        if value is None:
+            return True
+        if self.accepted.find(value, self.max_distance):
+            self.rejected += 1
+            return False
+        self.accepted.add(value, path)
+        return True
@@ -0,0 +1,196 @@
+import heapq
+import random
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+# Selection index over the photo library.  Dates are held in flat arrays sorted two
+# ways, by date for "most recent" and by day of the year for "around today in any
+# year", so each query is a couple of bisects instead of a scan over every photo.
+
+# First day of each month in a leap year, so Feb 29 gets its own day and every
+# other date lands on the same day number whatever the year
+MONTH_STARTS = (0, 0, 31, 60, 91, 121, 152, 182, 213, 244, 274, 305, 335)
+DAYS_IN_YEAR = 366
+
+def day_of_year(month, day):
+    """
+    :return: 0-365, counting as if every year were a leap year.
+    """
+    return MONTH_STARTS[month] + day - 1
+
+def parse_date(text):
+    """
+    Parses the 'YYYY-MM-DD' dates the photo catalog keeps.
+
+    :return: A (date ordinal, day of year) tuple, or None for "No EXIF data" and the like.
+    """
+    try:
+        year, month, day = int(text[0:4]), int(text[5:7]), int(text[8:10])
+        return date(year, month, day).toordinal(), day_of_year(month, day)
+    except ValueError:
+        return None
+
+class PhotoIndex:
+    """
+    Photos and their dates, indexed for selection.
+
+    Photos are numbered by date, oldest first, so a position is both an index into
+    paths and a rank by age.  by_day holds the same positions ordered by day of the
+    year, with day_keys alongside for bisecting.  Photos without a usable date are
+    kept in undated and only come up when padding out a selection.
+    """
+
+    def __init__(self, images_and_dates):
+        """
+        :param images_and_dates: A dict of path to 'YYYY-MM-DD', from PhotoCatalog.dates.
+                                 Undated photos carry their note instead, e.g. "No EXIF data".
+        """
+        # Libraries have far fewer distinct dates than photos, so group the photos by
+        # date string and do the per-date work (parsing, ordering) once per group
+        groups = {}
+        for path, text in images_and_dates.items():
+            group = groups.get(text)
+            if group is None:
+                group = groups[text] = []
+            group.append(path)
+
+        parsed_dates = {text: parse_date(text) for text in groups}
+        self.paths = []
+        self.ordinals = array('l')
+        self.undated = []
+        # Each day of the year's runs of positions, as (start, stop) ranges
+        day_runs = [[] for _ in range(DAYS_IN_YEAR)]
+        for (ordinal, day), text in sorted((parsed, text) for text, parsed in parsed_dates.items() if parsed):
+            group = groups[text]
+            day_runs[day].append((len(self.paths), len(self.paths) + len(group)))
+            self.paths += group
+            self.ordinals += array('l', [ordinal]) * len(group)
+        for text, parsed in parsed_dates.items():
+            if parsed is None:
+                self.undated += groups[text]
+
+        self.by_day = array('l')
+        self.day_keys = array('H')
+        for day, runs in enumerate(day_runs):
+            for start, stop in runs:
+                self.by_day.extend(range(start, stop))
+            self.day_keys += array('H', [day]) * (len(self.by_day) - len(self.day_keys))
+
+    def __len__(self):
+        return len(self.paths) + len(self.undated)
+
+    def recent(self, count):
+        """
+        :return: Positions of the newest count photos, newest first.
+        """
+        count = min(count, len(self.paths))
+        return range(len(self.paths) - 1, len(self.paths) - 1 - count, -1)
+
+    def seasonal(self, today, days_before, days_after):
+        """
+        Finds photos taken from days_before before today's date to days_after after it,
+        in any year.  A window that runs past the end of the year wraps into January.
+
+        :return: A list of (start, stop) slices of by_day.
+        """
+        if days_before + days_after + 1 >= DAYS_IN_YEAR:
+            return [(0, len(self.by_day))]
+        center = day_of_year(today.month, today.day)
+        first = (center - days_before) % DAYS_IN_YEAR
+        last = (center + days_after) % DAYS_IN_YEAR
+        if first <= last:
+            bounds = [(first, last)]
+        else:
+            bounds = [(first, DAYS_IN_YEAR - 1), (0, last)]
+        return [(bisect_left(self.day_keys, low), bisect_right(self.day_keys, high)) for low, high in bounds]
+
+    def sample(self, slices, count, weight=None, rng=random):
+        """
+        Picks up to count positions from the given slices of by_day without copying them.
+
+        :param weight: Optional function of a position; positions are then drawn with
+                       probability proportional to it (Efraimidis-Spirakis), in one pass
+                       that keeps only the count best keys.
+        :return: A list of positions, in random order.
+        """
+        total = sum(stop - start for start, stop in slices)
+        count = min(count, total)
+        if weight is None:
+            picks = []
+            for offset in rng.sample(range(total), count):
+                for start, stop in slices:
+                    if offset < stop - start:
+                        picks.append(self.by_day[start + offset])
+                        break
+                    offset -= stop - start
+            return picks
+
+        def keyed():
+            for start, stop in slices:
+                for i in range(start, stop):
+                    position = self.by_day[i]
+                    w = weight(position)
+                    if w > 0:
+                        yield rng.random() ** (1.0 / w), position
+        picks = [position for _, position in heapq.nlargest(count, keyed())]
+        rng.shuffle(picks)
+        return picks
+
+    def shuffled(self, rng=random):
+        """
+        Yields photos from the whole library, dated or not, in random order.  Big
+        libraries are drawn from with replacement rather than shuffled whole, so a
+        photo may come up more than once.
+        """
+        total = len(self.paths) + len(self.undated)
+        if total <= 4 * 1024:
+            draws = rng.sample(range(total), total)
+        else:
+            draws = (rng.randrange(total) for _ in range(total))
+        for i in draws:
+            yield self.paths[i] if i < len(self.paths) else self.undated[i - len(self.paths)]
+
+    def select(self, today, count, recent_count, days_before, days_after, weight=None, accept=None, rng=random):
+        """
+        Chooses the photos to show: the newest recent_count, then photos from around
+        today's date in other years, then anything else to make up count.
+
+        :param accept: Optional function of a path that returns False to pass a photo
+                       over, e.g. a photo_hash.NearDuplicateFilter.  It's called at
+                       most once per photo, in the order they'd be chosen.  Passed-over
+                       photos still fill any places left once the library runs out.
+        :return: A list of up to count paths.
+        """
+        chosen = []
+        chosen_set = set()
+        passed_over = []
+
+        def take(path):
+            if path in chosen_set:
+                return
+            chosen_set.add(path)
+            if accept is None or accept(path):
+                chosen.append(path)
+            else:
+                passed_over.append(path)
+
+        # Passed-over photos don't count, so keep going back until there are enough
+        recent_count = min(recent_count, count)
+        for position in self.recent(len(self.paths)):
+            if len(chosen) >= recent_count:
+                break
+            take(self.paths[position])
+        # Sample extra to make up for recent and passed-over photos
+        slices = self.seasonal(today, days_before, days_after)
+        for position in self.sample(slices, count * 4, weight, rng):
+            if len(chosen) >= count:
+                break
+            take(self.paths[position])
+        for path in self.shuffled(rng):
+            if len(chosen) >= count or len(chosen_set) >= len(self):
+                break
+            take(path)
+        # Rather a near-duplicate than an empty place
+        chosen += passed_over[:count - len(chosen)]
+        return chosen
@@ -5,8 +5,9 @@ import os
 import sys
 #import pygame
 os.environ["SDL_VIDEO_ALLOW_SCREENSAVER"] = "1"
-os.environ["SDL_VIDEODRIVER"] = "x11"
-os.environ["DISPLAY"] = ":0"
+# Defaults only, so benchmarks can run headless with SDL_VIDEODRIVER=dummy
+os.environ.setdefault("SDL_VIDEODRIVER", "x11")
+os.environ.setdefault("DISPLAY", ":0")
 
 # Handle -window-id from xscreensaver
 window_id = None
@@ -31,177 +32,936 @@ print(env_window)
 
 import pygame
 import time
-from PIL import Image
+import threading
+import gc
+from collections import OrderedDict
+from contextlib import nullcontext
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import json
 import calendar
+from derivatives import RAW_EXTENSION, fit_size, read_raw_image, write_layout, write_raw_pixels
+from slide_metrics import SlideMetrics, current_rss_kb, peak_rss_kb
+from shm_cache import SharedSlideCache
 
 load_dotenv()
 
 EVENT_FILE = os.environ.get('ALL_EVENTS_FILE', "./events.json")
 
+RAW_DIR = os.environ.get('RAW_DIR', "./raw_images")
+# Display-ready derivatives made by image_selector; preferred over RAW_DIR when present
+SLIDE_DIR = os.environ.get('SLIDE_DIR', "./slides")
+LAYOUT_FILE = os.environ.get('LAYOUT_FILE', "./layout.json")
+# The last composed frame, shown straight away on the next start while the rest loads.
+# It's saved when the panel changes, at most every SNAPSHOT_SECONDS, to spare the SD
+# card; unset, SNAPSHOT_FILE is one per screen (see snapshot_file).
+FAST_START = os.environ.get('FAST_START', "1") not in ("", "0")
+SNAPSHOT_FILE = os.environ.get('SNAPSHOT_FILE', "")
+SNAPSHOT_SECONDS = int(os.environ.get('SNAPSHOT_SECONDS', "3600"))
+
 FONT_FILE = os.environ.get('FONT_FILE', "/usr/share/fonts/truetype/freefont/FreeSans.ttf")
 
 GRADIENT_HEIGHT = 100
 
-# TODO:  Only read photo images once per day.  Read planner once per hour
+# LOW_MEMORY=1 is for 512 MB boards: photos are decoded at reduced resolution and scaled
+# into one reused buffer, the caches shrink, and they're emptied whenever the process
+# goes over MAX_RSS_MB (0 means no ceiling)
+LOW_MEMORY = os.environ.get('LOW_MEMORY', "") not in ("", "0")
+MAX_RSS_MB = int(os.environ.get('MAX_RSS_MB', "160" if LOW_MEMORY else "0"))
 
-def load_image(path):
-    pil_image = Image.open(path)
-    mode = pil_image.mode
-    size = pil_image.size
-    data = pil_image.tobytes()
-    return pygame.image.fromstring(data, size, mode)
+# How many upcoming slides to decode and scale ahead of time, and how much memory they may hold
+PREFETCH_DEPTH = int(os.environ.get('PREFETCH_DEPTH', "1" if LOW_MEMORY else "3"))
+PREFETCH_MEMORY_MB = int(os.environ.get('PREFETCH_MEMORY_MB', "8" if LOW_MEMORY else "64"))
+# Display-ready slides are kept around between passes, up to this much memory
+SLIDE_CACHE_MB = int(os.environ.get('SLIDE_CACHE_MB', "24" if LOW_MEMORY else "192"))
+# Prepared slides shared between screensaver processes (one per monitor, and across restarts).
+# SHM_CACHE_MB=0 turns it off.
+SHM_CACHE_DIR = os.environ.get('SHM_CACHE_DIR', "/dev/shm/calendar-screensaver")
+SHM_CACHE_MB = int(os.environ.get('SHM_CACHE_MB', "32" if LOW_MEMORY else "256"))
+# How many rendered strings (day names, dates, event titles) to keep
+TEXT_CACHE_SIZE = int(os.environ.get('TEXT_CACHE_SIZE', "512"))
 
-def render_calendar(events_by_day, width=1000, height=800):
+# Set WAKEUP_STATS=1 to print how often the main loop wakes up
+WAKEUP_STATS = os.environ.get('WAKEUP_STATS', "") not in ("", "0")
 
-    today = datetime.now().date()
-    year, month = today.year, today.month
-    cal = calendar.Calendar(firstweekday=6)  # Sunday start
+# TRANSITION=fade crossfades between slides for TRANSITION_SECONDS at up to TRANSITION_FPS
+TRANSITION = os.environ.get('TRANSITION', "cut")
+TRANSITION_SECONDS = float(os.environ.get('TRANSITION_SECONDS', "1.0"))
+TRANSITION_FPS = int(os.environ.get('TRANSITION_FPS', "30"))
+
+# Set METRICS_FILE to record per-slide stage timings, dumped as JSON every METRICS_INTERVAL seconds
+METRICS_FILE = os.environ.get('METRICS_FILE', "")
+METRICS_INTERVAL = int(os.environ.get('METRICS_INTERVAL', "60"))
+
+PORTRAIT = 0
+LANDSCAPE = 1
+
+# How often to look for a new events.json and a new day
+EVENTS_CHECK_SECONDS = int(os.environ.get('EVENTS_CHECK_SECONDS', "60"))
+# How often to look for new or removed photos
+DIR_CHECK_SECONDS = int(os.environ.get('DIR_CHECK_SECONDS', "30"))
+
+SLIDE_ADVANCE = pygame.USEREVENT + 1
+EVENTS_CHECK = pygame.USEREVENT + 2
+DIR_CHECK = pygame.USEREVENT + 3
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', RAW_EXTENSION)
+
+# TODO:  Only read photo images once per day.
+
+metrics = SlideMetrics(METRICS_FILE, METRICS_INTERVAL)
+
+# Pixel copies made while loading, so we can see what decoding costs beyond PIL itself
+load_stats = {"images": 0, "bytes_copied": 0}
+
+def normalize_mode(pil_image):
+    """
+    Converts an image to RGB or RGBA, the modes pygame can take directly.
+    CMYK, palette, greyscale and the like are converted once here.
+    """
+    if pil_image.mode in ("RGB", "RGBA"):
+        return pil_image
+    if pil_image.mode in ("LA", "PA", "RGBa") or "transparency" in pil_image.info:
+        return pil_image.convert("RGBA")
+    return pil_image.convert("RGB")
+
+def load_image(path, fit_within=None):
+    """
+    Decodes an image into a pygame surface.  The pixels are copied out of PIL once,
+    and the surface is built on that buffer instead of copying it again.
+
+    :param fit_within: Optional (width, height) the image will be scaled to fit.  If given,
+                       JPEGs are decoded at the smallest DCT scale that is still at least that
+                       big, and other formats are reduced by a whole factor after decoding.
+    """
+    # Imported here so a fast start from the snapshot doesn't wait for PIL
+    from PIL import Image
+
+    with Image.open(path) as pil_image:
+        if fit_within is not None:
+            target = fit_size(pil_image.width, pil_image.height, *fit_within)
+            pil_image.draft("RGB", target)
+        pil_image = normalize_mode(pil_image)
+        if fit_within is not None:
+            factor = min(pil_image.width // max(1, target[0]), pil_image.height // max(1, target[1]))
+            if factor >= 2:
+                pil_image = pil_image.reduce(factor)
+        mode = pil_image.mode
+        size = pil_image.size
+        data = pil_image.tobytes()
+    load_stats["images"] += 1
+    load_stats["bytes_copied"] += len(data)
+    return pygame.image.frombuffer(data, size, mode)
+
+def bytes_copied_per_image():
+    if load_stats["images"] == 0:
+        return 0
+    return load_stats["bytes_copied"] // load_stats["images"]
+
+def prepare_slide(image_path, photo_area, aspect):
+    """
+    Decodes a photo and scales it to fit the photo area, ready to be blitted.
+
+    :param image_path: The path to the photo.
+    :param photo_area: (x, y, width, height) of the photo area, before any portrait rotation.
+    :param aspect: PORTRAIT or LANDSCAPE.
+    :return: A (surface, (x, y)) tuple.
+    """
+    _, _, photo_area_width, photo_area_height = photo_area
+    # Derivatives from the nightly pipeline may already be scaled and rotated for us
+    rotated = False
+    with metrics.time("decode"):
+        if image_path.endswith(RAW_EXTENSION):
+            width, height, rotated, pixels = read_raw_image(image_path)
+            image = pygame.image.frombuffer(pixels, (width, height), "RGB")
+        else:
+            image = load_image(image_path, (photo_area_width, photo_area_height) if LOW_MEMORY else None)
+    img_w, img_h = image.get_size()
+    if rotated:
+        img_h, img_w = img_w, img_h
+    # Each step rebinds image, so the previous intermediate is freed straight away.
+    # In low-memory mode the scaled copy goes into the shared buffer, which stays
+    # locked until convert() has copied it out.
+    with scale_buffer.lock if LOW_MEMORY else nullcontext():
+        # Scale the image to fit the right side of the screen
+        scaled_w, scaled_h = fit_size(img_w, img_h, photo_area_width, photo_area_height)
+        if (scaled_w, scaled_h) != (img_w, img_h):
+            size = (scaled_h, scaled_w) if rotated else (scaled_w, scaled_h)
+            with metrics.time("scale"):
+                if LOW_MEMORY:
+                    image = scale_buffer.scale(image, size)
+                else:
+                    image = pygame.transform.smoothscale(image, size)
+        if aspect == PORTRAIT:
+            if not rotated:
+                with metrics.time("rotate"):
+                    image = pygame.transform.rotate(image, 90)
+        elif rotated:
+            with metrics.time("rotate"):
+                image = pygame.transform.rotate(image, -90)
+        # Match the display's pixel format so blits don't convert every time
+        with metrics.time("convert"):
+            image = image.convert()
+    return image, center_slide(image, photo_area, aspect)
+
+class ScaleBuffer:
+    """
+    One surface that photos are scaled into in low-memory mode, instead of allocating
+    a new one per slide.  It only grows, or is replaced when a photo's pixel format
+    differs.  Hold lock until the scaled image has been copied out.
+    """
+
+    def __init__(self):
+        self.surface = None
+        self.lock = threading.Lock()
+
+    def scale(self, image, size):
+        width, height = size
+        surface = self.surface
+        if surface is not None and (surface.get_bitsize(), surface.get_masks()) == (image.get_bitsize(), image.get_masks()):
+            if surface.get_width() >= width and surface.get_height() >= height:
+                return pygame.transform.smoothscale(image, size, surface.subsurface((0, 0, width, height)))
+            width, height = max(width, surface.get_width()), max(height, surface.get_height())
+        # Let go of the old buffer before allocating its replacement
+        self.surface = surface = None
+        self.surface = pygame.Surface((width, height), 0, image)
+        return pygame.transform.smoothscale(image, size, self.surface.subsurface((0, 0) + tuple(size)))
+
+scale_buffer = ScaleBuffer()
+
+def enforce_memory_ceiling(cache):
+    """
+    Empties the slide cache when the process is over MAX_RSS_MB, before another photo
+    is decoded.
+    """
+    if MAX_RSS_MB <= 0 or current_rss_kb() < MAX_RSS_MB * 1024:
+        return
+    cache.clear()
+    gc.collect()
+    rss_mb = current_rss_kb() / 1024
+    metrics.set("memory_ceiling_hits", metrics.extra.get("memory_ceiling_hits", 0) + 1)
+    if rss_mb >= MAX_RSS_MB:
+        print(f"Still using {rss_mb:.0f} MB after emptying the slide cache (ceiling {MAX_RSS_MB} MB)")
+
+def center_slide(image, photo_area, aspect):
+    """
+    :param image: The prepared surface, already rotated in portrait.
+    :return: The (x, y) that centers it in the photo area.
+    """
+    photo_area_x, photo_area_y, photo_area_width, photo_area_height = photo_area
+    if aspect == PORTRAIT:
+        return (photo_area_x + (photo_area_height - image.get_width()) // 2,
+                photo_area_y + (photo_area_width - image.get_height()) // 2)
+    return (photo_area_x + (photo_area_width - image.get_width()) // 2,
+            photo_area_y + (photo_area_height - image.get_height()) // 2)
+
+def snapshot_file(screen):
+    """
+    :return: Where this screen's snapshot goes: SNAPSHOT_FILE if it's set, otherwise a
+             file named for the screen size, X display and SDL_WINDOWID, so each
+             instance on a multi-head frame starts from its own frame.
+    """
+    if SNAPSHOT_FILE:
+        return SNAPSHOT_FILE
+    width, height = screen.get_size()
+    name = f"last_frame-{width}x{height}"
+    for variable in ("DISPLAY", "SDL_WINDOWID"):
+        if os.environ.get(variable):
+            name += "-" + "".join(c if c.isalnum() else "_" for c in os.environ[variable])
+    return os.path.join(".", name + RAW_EXTENSION)
+
+def show_snapshot(screen):
+    """
+    Puts the frame saved by the last run on screen, if it was saved at this screen size.
+
+    :return: True if the snapshot was shown.
+    """
+    try:
+        width, height, _, pixels = read_raw_image(snapshot_file(screen))
+    except (OSError, ValueError):
+        return False
+    if (width, height) != screen.get_size():
+        return False
+    screen.blit(pygame.image.frombuffer(pixels, (width, height), "RGB"), (0, 0))
+    pygame.display.flip()
+    return True
+
+def save_snapshot(screen):
+    path = snapshot_file(screen)
+    try:
+        write_raw_pixels(path, screen.get_size(), pygame.image.tostring(screen, "RGB"))
+    except OSError as e:
+        print(f"Could not save {path}: {e}")
+
+def list_images():
+    """
+    Lists the photos to show: the display-ready slides if image_selector made any,
+    otherwise the resized photos in RAW_DIR.
+    """
+    image_dir = RAW_DIR
+    if os.path.isdir(SLIDE_DIR) and os.listdir(SLIDE_DIR):
+        image_dir = SLIDE_DIR
+    return [os.path.join(image_dir, f) for f in os.listdir(image_dir) if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+class Playlist:
+    """
+    The photos to show, in order, kept in step with the image directory.
+    """
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.position = 0
+
+    def __len__(self):
+        return len(self.paths)
+
+    def next(self):
+        path = self.paths[self.position]
+        self.position = (self.position + 1) % len(self.paths)
+        return path
+
+    def upcoming(self, count):
+        """
+        :return: Up to count paths that will be shown next, not counting the current one.
+        """
+        count = min(count, len(self.paths) - 1)
+        return [self.paths[(self.position + n) % len(self.paths)] for n in range(count)]
+
+    def update(self, paths):
+        """
+        Drops photos that are gone and queues new ones after the rest of this pass.
+
+        :return: An (added, removed) tuple of path lists.
+        """
+        current = set(paths)
+        known = set(self.paths)
+        removed = [path for path in self.paths if path not in current]
+        added = [path for path in paths if path not in known]
+        if removed:
+            # Keep the same photo up next
+            upcoming = self.paths[self.position:] + self.paths[:self.position]
+            self.paths = [path for path in upcoming if path in current]
+            self.position = 0
+        self.paths.extend(added)
+        if self.position >= len(self.paths):
+            self.position = 0
+        return added, removed
+
+def slide_bytes(slide):
+    surface = slide[0]
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+class SlideCache:
+    """
+    Least-recently-used cache of display-ready slides, keyed by
+    (path, mtime, photo area, aspect) so a changed file or layout is never served stale.
+    """
+
+    def __init__(self, max_bytes=SLIDE_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.slides = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            slide = self.slides.get(key)
+            if slide is not None:
+                self.slides.move_to_end(key)
+            return slide
+
+    def put(self, key, slide):
+        size = slide_bytes(slide)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.slides:
+                self.total_bytes -= slide_bytes(self.slides.pop(key))
+            self.slides[key] = slide
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.slides.popitem(last=False)
+                self.total_bytes -= slide_bytes(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.slides.clear()
+            self.total_bytes = 0
+
+    def discard(self, path):
+        """
+        Drops every entry for path, whatever its mtime or geometry.
+        """
+        with self.lock:
+            for key in [key for key in self.slides if key[0] == path]:
+                self.total_bytes -= slide_bytes(self.slides.pop(key))
+
+def prepare_slide_cached(cache, image_path, photo_area, aspect, shared=None):
+    """
+    Same as prepare_slide, but served from the cache when the photo was prepared before,
+    by this process or, through the shared cache, by another one.
+    """
+    stat = os.stat(image_path)
+    key = (image_path, stat.st_mtime, tuple(photo_area), aspect)
+    slide = cache.get(key)
+    if slide is not None:
+        return slide
+    enforce_memory_ceiling(cache)
+    shared_key = shared.key(image_path, stat, tuple(photo_area), aspect) if shared is not None else None
+    entry = shared.get(shared_key) if shared is not None else None
+    if entry is not None:
+        width, height, pixels = entry
+        with metrics.time("convert"):
+            image = pygame.image.frombuffer(pixels, (width, height), "RGB").convert()
+        slide = (image, center_slide(image, photo_area, aspect))
+    else:
+        slide = prepare_slide(image_path, photo_area, aspect)
+        if shared is not None:
+            shared.put(shared_key, slide[0].get_size(), pygame.image.tostring(slide[0], "RGB"))
+    cache.put(key, slide)
+    return slide
+
+class SlidePrefetcher:
+    """
+    Prepares upcoming slides on a worker thread while the current one is on screen,
+    so the main loop only has to blit.  At most `depth` slides are kept ready, and the
+    worker pauses once the ready slides use more than `max_bytes`.
+    """
+
+    def __init__(self, prepare, depth=PREFETCH_DEPTH, max_bytes=PREFETCH_MEMORY_MB * 1024 * 1024):
+        self.prepare = prepare
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.wanted = []
+        self.ready = {}
+        self.ready_bytes = 0
+        self.failed = set()
+        self.warming = []
+        self.busy = None
+        self.stopped = False
+        self.lock = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, paths):
+        """
+        Tells the worker which slides come next.
+
+        :param paths: Upcoming image paths, nearest first.
+        """
+        with self.lock:
+            self.wanted = list(paths)[:self.depth]
+            for path in list(self.ready):
+                if path not in self.wanted:
+                    self._pop(path)
+            self.failed.intersection_update(self.wanted)
+            self.lock.notify_all()
+
+    def take(self, path):
+        """
+        Returns the prepared slide for path, preparing it on the spot if the worker
+        has not got to it yet.
+
+        :return: A (surface, (x, y)) tuple, or None if the photo could not be loaded.
+        """
+        with self.lock:
+            while self.busy == path:
+                self.lock.wait()
+            if path in self.ready:
+                return self._pop(path)
+            if path in self.failed:
+                return None
+            if path in self.wanted:
+                self.wanted.remove(path)
+        try:
+            return self.prepare(path)
+        except Exception as e:
+            print(f"Error loading {path}: {e}")
+            return None
+
+    def warm(self, paths):
+        """
+        Prepares slides once nothing upcoming is waiting, just to get them into the cache.
+        """
+        with self.lock:
+            self.warming.extend(path for path in paths if path not in self.warming)
+            self.lock.notify_all()
+
+    def forget(self, paths):
+        """
+        Drops anything prepared or queued for paths that no longer exist.
+        """
+        with self.lock:
+            for path in paths:
+                if path in self.ready:
+                    self._pop(path)
+                if path in self.wanted:
+                    self.wanted.remove(path)
+                if path in self.warming:
+                    self.warming.remove(path)
+                self.failed.discard(path)
+
+    def stop(self):
+        """
+        Stops the worker and waits for it to finish the slide it's on, so nothing is
+        still converting surfaces when pygame shuts down.
+        """
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _pop(self, path):
+        slide = self.ready.pop(path)
+        self.ready_bytes -= slide_bytes(slide)
+        self.lock.notify_all()
+        return slide
+
+    def _next_job(self):
+        if self.ready and self.ready_bytes >= self.max_bytes:
+            return None
+        for path in self.wanted:
+            if path not in self.ready and path not in self.failed:
+                return path
+        if self.warming:
+            return self.warming[0]
+        return None
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.stopped and self._next_job() is None:
+                    self.lock.wait()
+                if self.stopped:
+                    return
+                path = self._next_job()
+                self.busy = path
+                if path in self.warming:
+                    self.warming.remove(path)
+            try:
+                slide = self.prepare(path)
+            except Exception as e:
+                print(f"Error loading {path}: {e}")
+                slide = None
+            with self.lock:
+                self.busy = None
+                if slide is None:
+                    self.failed.add(path)
+                elif path in self.wanted and path not in self.ready:
+                    self.ready[path] = slide
+                    self.ready_bytes += slide_bytes(slide)
+                self.lock.notify_all()
+
+class WakeupCounter:
+    """
+    Counts main-loop wakeups, so we can check the screensaver really sleeps between slides.
+    """
+
+    def __init__(self, report=WAKEUP_STATS):
+        self.report = report
+        self.count = 0
+        self.per_minute = 0.0
+        self.window_start = time.monotonic()
+
+    def tick(self):
+        self.count += 1
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed >= 60:
+            self.per_minute = self.count * 60 / elapsed
+            if self.report:
+                print(f"Wakeups per minute: {self.per_minute:.1f}")
+            self.count = 0
+            self.window_start = now
+
+def repaint(screen, background, overlays, slide, rects):
+    """
+    Redraws the given screen rects from the background, photo and overlay layers,
+    and pushes just those rects to the display.
+    """
+    for rect in rects:
+        screen.set_clip(rect)
+        screen.blit(background, rect, rect)
+        if slide is not None:
+            screen.blit(slide[0], slide[1])
+        for overlay, position in overlays:
+            screen.blit(overlay, position)
+    screen.set_clip(None)
+    pygame.display.update(rects)
+
+# Achieved crossfade frame rate, across all transitions so far
+transition_stats = {"frames": 0, "dropped": 0, "seconds": 0.0}
+
+def crossfade(screen, background, overlays, slide, area, duration=TRANSITION_SECONDS, fps=TRANSITION_FPS):
+    """
+    Dissolves from what's on screen to the new slide, within the given area only.
+    Each frame blends the two with the surface alpha from the time elapsed, so a frame
+    that runs over its budget is dropped rather than slowing the fade down.
+    """
+    image, position = slide
+    old_frame = screen.subsurface(area).copy()
+    new_frame = pygame.Surface(area.size).convert()
+    new_frame.blit(background, (0, 0), area)
+    new_frame.blit(image, (position[0] - area.x, position[1] - area.y))
+    for overlay, overlay_position in overlays:
+        new_frame.blit(overlay, (overlay_position[0] - area.x, overlay_position[1] - area.y))
+
+    frame_time = 1 / fps
+    start = time.perf_counter()
+    last_frame = -1
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            break
+        frame = int(elapsed / frame_time)
+        transition_stats["dropped"] += max(0, frame - last_frame - 1)
+        last_frame = frame
+        with metrics.time("fade_frame"):
+            new_frame.set_alpha(int(255 * elapsed / duration))
+            screen.blit(old_frame, area)
+            screen.blit(new_frame, area)
+            pygame.display.update(area)
+        transition_stats["frames"] += 1
+        # Sleep until the next frame is due
+        time.sleep(max(0.0, (frame + 1) * frame_time - (time.perf_counter() - start)))
+    transition_stats["seconds"] += time.perf_counter() - start
+
+    new_frame.set_alpha(None)
+    screen.blit(new_frame, area)
+    pygame.display.update(area)
+    metrics.set("fade_fps", transition_stats["frames"] / transition_stats["seconds"])
+    metrics.set("fade_dropped_frames", transition_stats["dropped"])
+
+def show_slide(screen, background, overlays, slide, previous_rect=None):
+    """
+    Puts a slide on screen, redrawing and pushing only the photo rectangles.
+
+    :param screen: The display surface.
+    :param background: The static layer (panel and margins) the photo sits on.
+    :param overlays: (surface, (x, y)) pairs drawn over the photo, like the gradient.
+    :param slide: A (surface, (x, y)) tuple from prepare_slide.
+    :param previous_rect: Where the last photo was, so it can be erased.
+    :return: The rectangle the photo now occupies.
+    """
+    image, (image_x, image_y) = slide
+    rect = image.get_rect(topleft=(image_x, image_y))
+    if TRANSITION == "fade" and previous_rect is not None:
+        crossfade(screen, background, overlays, slide, rect.union(previous_rect))
+        return rect
+    dirty = [rect]
+    with metrics.time("blit"):
+        if previous_rect is not None and not rect.contains(previous_rect):
+            screen.blit(background, previous_rect, previous_rect)
+            dirty.append(previous_rect)
+        screen.blit(image, rect)
+        for dirty_rect in dirty:
+            screen.set_clip(dirty_rect)
+            for overlay, position in overlays:
+                screen.blit(overlay, position)
+        screen.set_clip(None)
+    with metrics.time("flip"):
+        pygame.display.update(dirty)
+    return rect
+
+# Calendar (portrait) panel layout and colors
+CALENDAR_FONT = "DejaVu Sans"
+CALENDAR_HEADER_FONT_SIZE = 32
+CALENDAR_DAY_FONT_SIZE = 18
+CALENDAR_EVENT_FONT_SIZE = 14
+CALENDAR_BACKGROUND_COLOR = (0, 0, 0)
+CALENDAR_TODAY_BACKGROUND_COLOR = (60, 60, 50)  # Highlight color for today
+CALENDAR_TEXT_COLOR = (255, 255, 255)
+CALENDAR_LINE_COLOR = (20, 20, 20)
+
+# Events (landscape) panel layout and colors
+EVENTS_FONT = "DejaVuSans"
+EVENTS_HEADER_FONT_SIZE = 24
+EVENTS_EVENT_FONT_SIZE = 14
+EVENTS_LINE_PADDING = 3
+EVENTS_BACKGROUND_COLOR = (255, 255, 255, 40)  # Semi-transparent white
+EVENTS_TODAY_BACKGROUND_COLOR = (80, 80, 60)
+EVENTS_TEXT_COLOR = (255, 255, 255)
+EVENTS_LINE_COLOR = (80, 80, 80)
+
+fonts = {}
+text_cache = OrderedDict()
+
+def get_font(name, size, bold=False):
+    """
+    Returns a shared font, so SysFont only searches the system fonts once per style.
+    """
+    key = (name, size, bold)
+    font = fonts.get(key)
+    if font is None:
+        font = pygame.font.SysFont(name, size, bold=bold)
+        fonts[key] = font
+    return font
 
-    # Fonts
-    header_font_size = 32
-    day_font_size = 18
-    event_font_size = 14
-    header_font = pygame.font.SysFont("DejaVu Sans", header_font_size, bold=True)
-    day_font = pygame.font.SysFont("DejaVu Sans", day_font_size, bold=True)
-    event_font = pygame.font.SysFont("DejaVu Sans", event_font_size)
-    
-    BACKGROUND_COLOR = (0,0,0)  # Semi-transparent white
-    TODAY_BACKGROUND_COLOR = (60, 60, 50)  # Highlight color for today
-    TEXT_COLOR = (255, 255, 255)
-    LINE_COLOR = (20, 20, 20)
-
-    # Layout
-    weeks = list(cal.monthdatescalendar(year, month))
+def render_text(name, size, text, color, bold=False):
+    """
+    Renders antialiased text, reusing the surface if the same string was rendered before.
+    Callers must not draw on the returned surface.
+    """
+    key = (name, size, bold, text, tuple(color))
+    surface = text_cache.get(key)
+    if surface is not None:
+        text_cache.move_to_end(key)
+        return surface
+    surface = get_font(name, size, bold).render(text, True, color)
+    text_cache[key] = surface
+    if len(text_cache) > TEXT_CACHE_SIZE:
+        text_cache.popitem(last=False)
+    return surface
+
+def calendar_cells(today, width, height):
+    """
+    Lays out the month grid containing today.
+
+    :return: A dict mapping each date on the grid to its cell rect.
+    """
+    cal = calendar.Calendar(firstweekday=6)  # Sunday start
+    weeks = list(cal.monthdatescalendar(today.year, today.month))
     n_rows = len(weeks)
     n_cols = 7
     cell_width = width // n_cols
-    cell_height = (height - header_font_size - 10) // n_rows
+    cell_height = (height - CALENDAR_HEADER_FONT_SIZE - 10) // n_rows
+
+    cells = {}
+    for row_idx, week in enumerate(weeks):
+        for col_idx, day in enumerate(week):
+            x = col_idx * cell_width
+            y = CALENDAR_HEADER_FONT_SIZE + 10 + CALENDAR_DAY_FONT_SIZE + row_idx * cell_height
+            cells[day] = pygame.Rect(x, y, cell_width, cell_height)
+    return cells
+
+def draw_calendar_day(surface, rect, day, today, events):
+    """
+    Draws one day cell of the month grid, replacing whatever was there.
+    """
+    x, y = rect.x, rect.y
+    surface.set_clip(rect)
+
+    # Highlight today
+    if day == today:
+        pygame.draw.rect(surface, CALENDAR_TODAY_BACKGROUND_COLOR, rect, 0)
+    else:
+        pygame.draw.rect(surface, CALENDAR_BACKGROUND_COLOR, rect, 0)
+
+    # Dim days not in current month
+    day_color = CALENDAR_TEXT_COLOR if day.month == today.month else (160, 160, 160)
+    day_surface = render_text(CALENDAR_FONT, CALENDAR_DAY_FONT_SIZE, str(day.day), day_color, bold=True)
+    surface.blit(day_surface, (x + 4, y + 2))
+
+    # Events
+    events = list(events)
+    if len(events) > 4:
+        events = events[:4]
+        events[3] = "..."  # Indicate more events
+    for i in range(len(events)):
+        if len(events[i]) > 15:
+            events[i] = events[i][:12] + '...'
+        event_surface = render_text(CALENDAR_FONT, CALENDAR_EVENT_FONT_SIZE, events[i], CALENDAR_TEXT_COLOR)
+        surface.blit(event_surface, (x + 8, y + 24 + i * (CALENDAR_EVENT_FONT_SIZE + 2)))
+
+    # Cell border
+    pygame.draw.rect(surface, CALENDAR_LINE_COLOR, rect, 1)
+    surface.set_clip(None)
+
+def render_calendar(events_by_day, width=1000, height=800, today=None):
+
+    if today is None:
+        today = datetime.now().date()
+    cells = calendar_cells(today, width, height)
+    cell_width = width // 7
 
     surface = pygame.Surface((width, height), pygame.SRCALPHA)
-    surface.fill(BACKGROUND_COLOR)
-    #pygame.draw.rect(surface, LINE_COLOR, (0, 0, width, height), 1)
+    surface.fill(CALENDAR_BACKGROUND_COLOR)
 
     # Month header
     month_name = today.strftime("%B %Y")
-    header_surface = header_font.render(month_name, True, TEXT_COLOR)
+    header_surface = render_text(CALENDAR_FONT, CALENDAR_HEADER_FONT_SIZE, month_name, CALENDAR_TEXT_COLOR, bold=True)
     surface.blit(header_surface, ((width - header_surface.get_width()) // 2, 2))
 
     # Day names
     for i, day_name in enumerate(['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat']):
-        dn_surface = day_font.render(day_name, True, TEXT_COLOR)
+        dn_surface = render_text(CALENDAR_FONT, CALENDAR_DAY_FONT_SIZE, day_name, CALENDAR_TEXT_COLOR, bold=True)
         x = i * cell_width + (cell_width - dn_surface.get_width()) // 2
-        y = header_font_size + 5
+        y = CALENDAR_HEADER_FONT_SIZE + 5
         surface.blit(dn_surface, (x, y))
 
     # Calendar grid and events
-    for row_idx, week in enumerate(weeks):
-        for col_idx, day in enumerate(week):
-            x = col_idx * cell_width
-            y = header_font_size + 10 + day_font_size + row_idx * cell_height
-
-            # Highlight today
-            if day == today:
-                pygame.draw.rect(surface, TODAY_BACKGROUND_COLOR, (x, y, cell_width, cell_height), 0)
-            else:
-                # A hacky way to ensure events from other days don't spill over
-                pygame.draw.rect(surface, BACKGROUND_COLOR, (x, y, cell_width, cell_height), 0)
-
-            # Dim days not in current month
-            day_color = TEXT_COLOR if day.month == month else (160, 160, 160)
-            day_surface = day_font.render(str(day.day), True, day_color)
-            surface.blit(day_surface, (x + 4, y + 2))
-
-            # Events
-            events = events_by_day.get(day, [])
-            if len(events) > 4:
-                events = events[:4]
-                events[3] = "..."  # Indicate more events
-            for i in range(len(events)):
-                if len(events[i]) > 15:
-                    events[i] = events[i][:12] + '...'
-                event_surface = event_font.render(events[i], True, TEXT_COLOR)
-                surface.blit(event_surface, (x + 8, y + 24 + i * (event_font_size + 2)))
-
-            # Cell border
-            pygame.draw.rect(surface, LINE_COLOR, (x, y, cell_width, cell_height), 1)
+    for day, rect in cells.items():
+        draw_calendar_day(surface, rect, day, today, events_by_day.get(day, []))
 
     return surface
 
 def get_most_recent_sunday(date):
     return date - timedelta(days=date.weekday() + 1) if date.weekday() != 6 else date
 
+def events_cells(today, width, height):
+    """
+    Lays out the two weeks starting the Sunday before today: 2 columns (weeks), 7 rows (days).
 
-def render_events(events_by_day, width=1000, height=1400):
-
-    header_font_size = 24
-    event_font_size = 14
-    line_padding = 3
-    # Font setup
-    header_font = pygame.font.SysFont("DejaVuSans", header_font_size, bold=True)
-    event_font = pygame.font.SysFont("DejaVuSans", event_font_size)
-
-    BACKGROUND_COLOR = (255, 255, 255, 40)  # Semi-transparent white
-    TEXT_COLOR = (255, 255, 255)
-    LINE_COLOR = (80, 80, 80)
-
-    surface = pygame.Surface((width, height), pygame.SRCALPHA)
-    surface.fill(BACKGROUND_COLOR)  # Semi-transparent white background
-    # Draw calendar layout
-    today = datetime.now().date()
+    :return: A dict mapping each date shown to its cell rect.
+    """
     start_sunday = get_most_recent_sunday(today)
-
-    # Layout: 2 columns (weeks), 7 rows (days)
     col_width = width // 2
     row_height = height // 7
 
+    cells = {}
     for week in range(2):
         for day_idx in range(7):
             day = start_sunday + timedelta(days=week * 7 + day_idx)
-            
-            x0 = week * col_width
-            y0 = day_idx * row_height
-
-             # Highlight today
-            if day == today:
-                pygame.draw.rect(surface, (80, 80, 60), (x0, y0, col_width, row_height), 0)
-
-
-            # Header: "Jun 8 - Sunday"
-            header_text = f"{day.strftime('%b')} {day.day} - {day.strftime('%A')}"
-            header_surface = header_font.render(header_text, True, TEXT_COLOR)
-            surface.blit(header_surface, (x0 + 5, y0 + 4))
-
-            # Events
-            events = events_by_day.get(day, [])
-            for j, event in enumerate(events):
-                event_surface = event_font.render(f"- {event}", True, TEXT_COLOR)
-                surface.blit(event_surface, (x0 + 20, y0 + 4 + (header_font_size + line_padding) + j * (event_font_size + line_padding)))
-
-            # Separator line
-            if day_idx < 6:
-                pygame.draw.line(surface, LINE_COLOR, (0, y0 + row_height - 1), (width, y0 + row_height - 1), 1)
-        
-        # Draw vertical separator between weeks
-        if week == 0:
-            pygame.draw.line(surface, LINE_COLOR, (col_width - 1, 0), (col_width - 1, height), 2)
+            cells[day] = pygame.Rect(week * col_width, day_idx * row_height, col_width, row_height)
+    return cells
+
+def draw_events_day(surface, rect, day, today, events):
+    """
+    Draws one day of the two-week event list, replacing whatever was there.
+    """
+    x0, y0 = rect.x, rect.y
+    col_width = surface.get_width() // 2
+    second_week = rect.left >= col_width
+    # The lines run on into any strips left at the right and bottom of the panel when
+    # its size doesn't divide evenly into cells
+    lines_area = pygame.Rect(rect.left, rect.top, (surface.get_width() if second_week else rect.right) - rect.left,
+                             (surface.get_height() if day.weekday() == 5 else rect.bottom) - rect.top)
+    # The 2 px vertical separator between weeks covers both sides of the middle: drawn
+    # over the first week's cells, and under the second's
+    separator = pygame.Rect(col_width - 1, 0, 2, surface.get_height()).clip(lines_area)
+    surface.fill(EVENTS_BACKGROUND_COLOR, rect)
+    if second_week:
+        surface.fill(EVENTS_LINE_COLOR, separator)
+    surface.set_clip(rect)
+
+    # Highlight today
+    if day == today:
+        pygame.draw.rect(surface, EVENTS_TODAY_BACKGROUND_COLOR, rect, 0)
+
+    # Header: "Jun 8 - Sunday"
+    header_text = f"{day.strftime('%b')} {day.day} - {day.strftime('%A')}"
+    header_surface = render_text(EVENTS_FONT, EVENTS_HEADER_FONT_SIZE, header_text, EVENTS_TEXT_COLOR, bold=True)
+    surface.blit(header_surface, (x0 + 5, y0 + 4))
+
+    # Events
+    for j, event in enumerate(events):
+        event_surface = render_text(EVENTS_FONT, EVENTS_EVENT_FONT_SIZE, f"- {event}", EVENTS_TEXT_COLOR)
+        surface.blit(event_surface, (x0 + 20, y0 + 4 + (EVENTS_HEADER_FONT_SIZE + EVENTS_LINE_PADDING) + j * (EVENTS_EVENT_FONT_SIZE + EVENTS_LINE_PADDING)))
+
+    surface.set_clip(lines_area)
+    # Separator line, except under Saturday
+    if day.weekday() != 5:
+        pygame.draw.line(surface, EVENTS_LINE_COLOR, (rect.left, rect.bottom - 1), (lines_area.right, rect.bottom - 1), 1)
+    if not second_week:
+        surface.fill(EVENTS_LINE_COLOR, separator)
+    surface.set_clip(None)
+
+def render_events(events_by_day, width=1000, height=1400, today=None):
+
+    if today is None:
+        today = datetime.now().date()
+
+    surface = pygame.Surface((width, height), pygame.SRCALPHA)
+    surface.fill(EVENTS_BACKGROUND_COLOR)  # Semi-transparent white background
+
+    for day, rect in events_cells(today, width, height).items():
+        draw_events_day(surface, rect, day, today, events_by_day.get(day, []))
 
     return surface
 
-def run_slideshow(display_time=20):
+def load_events_by_day(event_file):
+    """
+    Reads the JSON file of events written by get_calendar_events.
+
+    :return: A dict mapping dates to lists of event names.
+    """
+    with open(event_file, 'r') as file:
+        events_dict = json.load(file)
+
+    # Organize events by day
+    events_by_day = {}
+    for dt_str, events in events_dict.items():
+        dt = datetime.fromisoformat(dt_str)
+        day_key = dt.date()
+        events_by_day.setdefault(day_key, []).extend(events)
+    return events_by_day
+
+class EventPanel:
+    """
+    The rendered events (landscape) or calendar (portrait) panel.  When the events or
+    the date change, only the day cells that differ are redrawn; the whole panel is
+    re-rendered only when a new week or month comes into view.
+    """
+
+    def __init__(self, aspect, width, height, events_by_day, today=None):
+        self.aspect = aspect
+        self.width = width
+        self.height = height
+        self.events_by_day = events_by_day
+        self.today = today if today is not None else datetime.now().date()
+        with metrics.time("panel"):
+            self.surface = self._render()
+
+    def _render(self):
+        if self.aspect == PORTRAIT:
+            return render_calendar(self.events_by_day, self.width, self.height, self.today)
+        return render_events(self.events_by_day, self.width, self.height, self.today)
+
+    def _cells(self, today):
+        if self.aspect == PORTRAIT:
+            return calendar_cells(today, self.width, self.height)
+        return events_cells(today, self.width, self.height)
+
+    def update(self, events_by_day, today):
+        """
+        Brings the panel up to date.
+
+        :return: The panel rects that were redrawn, or None if the whole panel was.
+        """
+        cells = self._cells(today)
+        if cells.keys() != self._cells(self.today).keys():
+            self.events_by_day = events_by_day
+            self.today = today
+            with metrics.time("panel"):
+                self.surface = self._render()
+            return None
+
+        changed = {day for day in cells if events_by_day.get(day, []) != self.events_by_day.get(day, [])}
+        if today != self.today:
+            changed.update(day for day in (self.today, today) if day in cells)
+
+        draw_day = draw_calendar_day if self.aspect == PORTRAIT else draw_events_day
+        dirty = []
+        with metrics.time("panel"):
+            for day in changed:
+                draw_day(self.surface, cells[day], day, today, events_by_day.get(day, []))
+                dirty.append(cells[day].clip(self.surface.get_rect()))
+        self.events_by_day = events_by_day
+        self.today = today
+        return dirty
+
+def run_slideshow(display_time=20, aspect=LANDSCAPE, screen_size=(0, 0), max_slides=None):
+    """
+    Shows the events panel and cycles through the photos until asked to quit.
+
+    :param display_time: Seconds per slide.  0 advances as fast as slides can be shown.
+    :param aspect: PORTRAIT or LANDSCAPE.
+    :param screen_size: Window size; (0, 0) uses the whole display.
+    :param max_slides: Stop after this many slides, for benchmarking.  None runs forever.
+    """
+    start_time = time.perf_counter()
     pygame.init()
-    screen = pygame.display.set_mode((0, 0)) #, pygame.FULLSCREEN)
+    screen = pygame.display.set_mode(screen_size) #, pygame.FULLSCREEN)
 #    screen = pygame.display.set_mode((1000, 1400), pygame.FULLSCREEN)
     #pygame.mouse.set_visible(False)
     pygame.mouse.set_visible(False)
-    image_dir = "./raw_images"
+    snapshot_shown = FAST_START and show_snapshot(screen)
+    if snapshot_shown:
+        metrics.set("time_to_snapshot_s", time.perf_counter() - start_time)
     #planner_image = "./planner.png"
 
-    PORTRAIT = 0
-    LANDSCAPE = 1
-    ASPECT = LANDSCAPE
+    ASPECT = aspect
     screen_width, screen_height = (0, 0)
     if ASPECT == LANDSCAPE:
         screen_width, screen_height = screen.get_size()
@@ -211,18 +971,8 @@ def run_slideshow(display_time=20):
     #half_width = screen_width // 2
     margin = 10
     # Prepare events grouped by day
-
-    # Open and read the JSON file of events
-    events_dict = []
-    with open(EVENT_FILE, 'r') as file:
-        events_dict = json.load(file)
-
-    # Organize events by day
-    events_by_day = {}
-    for dt_str, events in events_dict.items():
-        dt = datetime.fromisoformat(dt_str)
-        day_key = dt.date()
-        events_by_day.setdefault(day_key, []).extend(events)
+    events_mtime = os.path.getmtime(EVENT_FILE)
+    events_by_day = load_events_by_day(EVENT_FILE)
 
     gradient_surface = None
     # Create the event surface
@@ -235,7 +985,8 @@ def run_slideshow(display_time=20):
         photo_area_height = screen_height - (2 * margin)
         photo_area_x = screen_width / 2
         photo_area_y = 0
-        event_surface = render_events(events_by_day, event_area_width, event_area_height)
+        panel = EventPanel(ASPECT, event_area_width, event_area_height, events_by_day)
+        event_surface = panel.surface
     else:
         event_area_width = screen_width - (2 * margin)
         event_area_height = screen_height / 2 - (2 * margin)
@@ -245,11 +996,11 @@ def run_slideshow(display_time=20):
         photo_area_height = screen_height / 2 - (2 * margin)
         photo_area_x = margin
         photo_area_y = margin
-        event_surface = render_calendar(events_by_day, event_area_width, event_area_height)
-        event_surface = pygame.transform.rotate(event_surface, 90)
+        panel = EventPanel(ASPECT, event_area_width, event_area_height, events_by_day)
+        event_surface = pygame.transform.rotate(panel.surface, 90)
         gradient = load_image("gradient.png")
         gradient_scaled = pygame.transform.smoothscale(gradient, (screen_width, GRADIENT_HEIGHT)) 
-        gradient_surface = pygame.transform.rotate(gradient_scaled, 90)
+        gradient_surface = pygame.transform.rotate(gradient_scaled, 90).convert_alpha()
     # planner = load_image(planner_image)
     # planner_scale = screen_height / planner.get_height()
     # planner_scaled_h = screen_height - (2 * margin)
@@ -260,45 +1011,156 @@ def run_slideshow(display_time=20):
 
 
  
-    image_paths = [os.path.join(image_dir, f) for f in os.listdir(image_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    playlist = Playlist(list_images())
 
-    while True:
+    photo_area = (photo_area_x, photo_area_y, photo_area_width, photo_area_height)
+    # Tell the nightly pipeline what size to make the photos
+    try:
+        write_layout(LAYOUT_FILE, {
+            "screen_width": screen.get_width(),
+            "screen_height": screen.get_height(),
+            "aspect": "portrait" if ASPECT == PORTRAIT else "landscape",
+            "margin": margin,
+            "photo_width": int(photo_area_width),
+            "photo_height": int(photo_area_height),
+            "rotate": 90 if ASPECT == PORTRAIT else 0,
+        })
+    except OSError as e:
+        print(f"Could not write {LAYOUT_FILE}: {e}")
+    slide_cache = SlideCache()
+    shared_cache = None
+    if SHM_CACHE_MB > 0:
+        try:
+            shared_cache = SharedSlideCache(SHM_CACHE_DIR, SHM_CACHE_MB * 1024 * 1024)
+        except OSError as e:
+            print(f"Not sharing slides through {SHM_CACHE_DIR}: {e}")
+    prefetcher = SlidePrefetcher(lambda path: prepare_slide_cached(slide_cache, path, photo_area, ASPECT, shared_cache))
 
-        for image_path in image_paths:
-            image = load_image(image_path)
-            img_aspect = image.get_width() / image.get_height()
-            # Scale the image to fit the right side of the screen
-            photo_target_w, photo_target_h = photo_area_width, photo_area_height
-            if photo_target_w / photo_target_h > img_aspect:
-                scaled_h = photo_target_h
-                scaled_w = int(scaled_h * img_aspect)
-            else:
-                scaled_w = photo_target_w
-                scaled_h = int(scaled_w / img_aspect)
-            image_scaled = pygame.transform.smoothscale(image, (scaled_w, scaled_h))
-            # Center the image
-            image_x = photo_area_x + (photo_area_width - scaled_w) // 2
-            image_y = photo_area_y + (photo_area_height - scaled_h) // 2
+    # Everything but the photo is drawn once; slides only touch the photo rectangle
+    background = pygame.Surface(screen.get_size()).convert()
+    background.fill((0, 0, 0))
+    background.blit(event_surface, (event_area_x, event_area_y))
+    overlays = []
+    if gradient_surface is not None:
+        overlays.append((gradient_surface, ((screen_height/2) - GRADIENT_HEIGHT, 0)))
+    screen.blit(background, (0, 0))
+    for overlay, position in overlays:
+        screen.blit(overlay, position)
+    # Leave the snapshot up until the first photo is ready too
+    if not snapshot_shown:
+        pygame.display.flip()
+    photo_rect = None
+    last_snapshot = None
+    # The first frame with a photo is saved, then the first after each panel change
+    snapshot_due = FAST_START
+    current_slide = None
 
+    def refresh_panel(dirty):
+        """
+        Copies redrawn panel rects (or the whole panel, if dirty is None) into the
+        background layer and onto the screen.
+        """
+        nonlocal snapshot_due
+        if dirty is None:
+            dirty = [panel.surface.get_rect()]
+        screen_rects = []
+        for rect in dirty:
+            piece = panel.surface.subsurface(rect)
             if ASPECT == PORTRAIT:
-                image_y = photo_area_y + (photo_area_width - scaled_w) // 2
-                image_x = photo_area_x + (photo_area_height - scaled_h) // 2
-                image_scaled = pygame.transform.rotate(image_scaled, 90)
-            # Display the event surface and image
-            screen.fill((0, 0, 0))
-            screen.blit(event_surface, (event_area_x, event_area_y))
-            screen.blit(image_scaled, (image_x, image_y))
-
-            if gradient_surface is not None:
-                screen.blit(gradient_surface, ((screen_height/2) - GRADIENT_HEIGHT, 0))
-            pygame.display.flip()
-            start_time = time.time()
-            while time.time() - start_time < display_time:
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        pygame.quit()
-                        return
-                time.sleep(0.1)
+                # The panel is shown rotated 90 degrees counterclockwise
+                piece = pygame.transform.rotate(piece, 90)
+                screen_rect = pygame.Rect(event_area_x + rect.y, event_area_y + panel.surface.get_width() - rect.right, rect.height, rect.width)
+            else:
+                screen_rect = rect.move(event_area_x, event_area_y)
+            background.fill((0, 0, 0), screen_rect)
+            background.blit(piece, screen_rect)
+            screen_rects.append(screen_rect)
+        repaint(screen, background, overlays, current_slide, screen_rects)
+        snapshot_due = FAST_START
+
+    # Sleep in pygame.event.wait() until a slide is due, the events need checking, or we're asked to quit
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed([pygame.QUIT, SLIDE_ADVANCE, EVENTS_CHECK, DIR_CHECK])
+    # And when something that covered the window (an unlock dialog, say) goes away
+    expose_events = [pygame.VIDEOEXPOSE] + ([pygame.WINDOWEXPOSED] if hasattr(pygame, "WINDOWEXPOSED") else [])
+    pygame.event.set_allowed(expose_events)
+    if display_time > 0:
+        pygame.time.set_timer(SLIDE_ADVANCE, int(display_time * 1000))
+    pygame.time.set_timer(EVENTS_CHECK, EVENTS_CHECK_SECONDS * 1000)
+    pygame.time.set_timer(DIR_CHECK, DIR_CHECK_SECONDS * 1000)
+    pygame.event.post(pygame.event.Event(SLIDE_ADVANCE))
+    wakeups = WakeupCounter()
+    slides_shown = 0
+
+    while max_slides is None or slides_shown < max_slides:
+        event = pygame.event.wait()
+        wakeups.tick()
+        metrics.set("wakeups_per_minute", wakeups.per_minute)
+        metrics.set("bytes_copied_per_image", bytes_copied_per_image())
+        metrics.set("rss_kb", current_rss_kb())
+        metrics.maybe_dump()
+        if event.type == pygame.QUIT:
+            break
+        if event.type in expose_events:
+            repaint(screen, background, overlays, current_slide, [screen.get_rect()])
+        elif event.type == SLIDE_ADVANCE:
+            # Skip photos that fail to load, but only go around the playlist once
+            for _ in range(len(playlist)):
+                slide = prefetcher.take(playlist.next())
+                # Start on the next ones while this one is on screen
+                prefetcher.schedule(playlist.upcoming(PREFETCH_DEPTH))
+                if slide is not None:
+                    photo_rect = show_slide(screen, background, overlays, slide, photo_rect)
+                    current_slide = slide
+                    if slides_shown == 0:
+                        if snapshot_shown:
+                            pygame.display.flip()
+                        metrics.set("time_to_first_frame_s", time.perf_counter() - start_time)
+                    slides_shown += 1
+                    if snapshot_due and (last_snapshot is None or time.monotonic() - last_snapshot >= SNAPSHOT_SECONDS):
+                        save_snapshot(screen)
+                        last_snapshot = time.monotonic()
+                        snapshot_due = False
+                    break
+            if display_time <= 0:
+                pygame.event.post(pygame.event.Event(SLIDE_ADVANCE))
+        elif event.type == EVENTS_CHECK:
+            # Pick up the nightly events.json refresh, and move the "today" highlight at midnight
+            try:
+                mtime = os.path.getmtime(EVENT_FILE)
+                if mtime != events_mtime:
+                    events_by_day = load_events_by_day(EVENT_FILE)
+                    events_mtime = mtime
+            except (OSError, ValueError) as e:
+                print(f"Error reloading {EVENT_FILE}: {e}")
+            today = datetime.now().date()
+            if events_by_day is not panel.events_by_day or today != panel.today:
+                refresh_panel(panel.update(events_by_day, today))
+        elif event.type == DIR_CHECK:
+            # Follow the nightly refresh of the photos without a restart
+            try:
+                added, removed = playlist.update(list_images())
+            except OSError as e:
+                print(f"Error listing photos: {e}")
+                continue
+            if added or removed:
+                print(f"Photos changed: {len(added)} added, {len(removed)} removed")
+                prefetcher.forget(removed)
+                for path in removed:
+                    slide_cache.discard(path)
+                prefetcher.schedule(playlist.upcoming(PREFETCH_DEPTH))
+                prefetcher.warm(added)
+
+    pygame.time.set_timer(SLIDE_ADVANCE, 0)
+    pygame.time.set_timer(EVENTS_CHECK, 0)
+    pygame.time.set_timer(DIR_CHECK, 0)
+    # Before pygame.quit(), which a slide still being prepared would need
+    prefetcher.stop()
+    print(f"Loaded {load_stats['images']} images, {bytes_copied_per_image()} bytes copied per image")
+    print(f"Peak RSS: {peak_rss_kb() / 1024:.1f} MB")
+    metrics.set("rss_kb", current_rss_kb())
+    metrics.dump()
+    pygame.quit()
 
 if __name__ == "__main__":
     # Replace this with your image directory logic
@@ -0,0 +1,81 @@
+import hashlib
+import os
+import time
+
+from derivatives import RAW_EXTENSION, read_raw_image, write_raw_pixels
+
+# Display-ready slides shared between screensaver processes.  Entries are raw slide
+# files on a tmpfs (/dev/shm), so a new process, or the instance on the other monitor,
+# maps the pixels another one already decoded and scaled instead of decoding again.
+
+class SharedSlideCache:
+    """
+    A directory of prepared slides, keyed by the source file's identity and the
+    target geometry.  Hits are marked by touching the entry, and the least recently
+    used entries are removed once the directory grows past max_bytes.  Entries that
+    haven't been used for max_age seconds are removed too, since a changed or deleted
+    source file means its old entries will never be hit again.
+    """
+
+    def __init__(self, directory, max_bytes, max_age=2 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, image_path, stat, *geometry):
+        # Not the real path: SLIDE_DIR points at a new directory of links every night,
+        # while the links' inode stays the same for as long as the slide does
+        identity = (os.path.abspath(image_path), stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns) + geometry
+        return hashlib.sha1(repr(identity).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + RAW_EXTENSION)
+
+    def get(self, key):
+        """
+        :return: A (width, height, pixels) tuple mapped from the shared entry, or None.
+        """
+        path = self._path(key)
+        try:
+            width, height, _, pixels = read_raw_image(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return width, height, pixels
+
+    def put(self, key, size, pixels):
+        """
+        Stores RGB pixels of the given (width, height), then trims the cache.
+        """
+        if len(pixels) > self.max_bytes:
+            return
+        try:
+            write_raw_pixels(self._path(key), size, pixels)
+        except OSError as e:
+            print(f"Could not write to the shared slide cache: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        entries = []
+        now = time.time()
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(RAW_EXTENSION):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_bytes and now - mtime < self.max_age:
+                break
+            try:
+                # Processes that already mapped the entry keep their pages
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,125 @@
+import json
+import os
+import resource
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds, in milliseconds
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+class SlideMetrics:
+    """
+    Times the stages of putting a slide on screen (decode, scale, rotate, blit, flip,
+    panel render, ...), keeps the last `window` samples of each, and periodically
+    writes percentiles, histograms and peak RSS to a JSON file.
+
+    With no metrics_file, timing is skipped entirely.
+    """
+
+    def __init__(self, metrics_file=None, interval=60, window=500):
+        self.metrics_file = metrics_file
+        self.enabled = bool(metrics_file)
+        self.interval = interval
+        self.window = window
+        self.samples = {}
+        self.counts = {}
+        self.extra = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.last_dump = time.monotonic()
+
+    @contextmanager
+    def time(self, stage):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window)
+                self.counts[stage] = 0
+            self.samples[stage].append(seconds * 1000)
+            self.counts[stage] += 1
+
+    def set(self, name, value):
+        """
+        Adds a plain value, like wakeups per minute, to the next dump.
+        """
+        self.extra[name] = value
+
+    def snapshot(self):
+        with self.lock:
+            samples = {stage: sorted(values) for stage, values in self.samples.items()}
+            counts = dict(self.counts)
+        stages = {}
+        for stage, values in samples.items():
+            if not values:
+                continue
+            histogram = [0] * (len(BUCKETS_MS) + 1)
+            for value in values:
+                bucket = 0
+                while bucket < len(BUCKETS_MS) and value > BUCKETS_MS[bucket]:
+                    bucket += 1
+                histogram[bucket] += 1
+            stages[stage] = {
+                "count": counts[stage],
+                "mean_ms": sum(values) / len(values),
+                "p50_ms": percentile(values, 50),
+                "p90_ms": percentile(values, 90),
+                "p99_ms": percentile(values, 99),
+                "max_ms": values[-1],
+                "histogram_ms": {"buckets": list(BUCKETS_MS), "counts": histogram},
+            }
+        return {
+            "time": time.time(),
+            "uptime_s": time.time() - self.started,
+            "peak_rss_kb": peak_rss_kb(),
+            "stages": stages,
+            **self.extra,
+        }
+
+    def maybe_dump(self):
+        """
+        Writes the metrics file if the dump interval has passed.
+        """
+        if not self.enabled or time.monotonic() - self.last_dump < self.interval:
+            return
+        self.dump()
+
+    def dump(self):
+        if not self.enabled or not self.metrics_file:
+            return
+        self.last_dump = time.monotonic()
+        tmp_file = self.metrics_file + ".tmp"
+        try:
+            with open(tmp_file, 'w') as file:
+                json.dump(self.snapshot(), file, indent=2)
+            os.replace(tmp_file, self.metrics_file)
+        except OSError as e:
+            print(f"Could not write {self.metrics_file}: {e}")
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def current_rss_kb():
+    try:
+        with open("/proc/self/statm") as file:
+            resident_pages = int(file.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return peak_rss_kb()
+    return resident_pages * (resource.getpagesize() // 1024)